@@ -0,0 +1,250 @@
+"""
+Benchmarks for the hot paths of wolf_ism8: float codec, datapoint decoding,
+frame parsing in data_received and building of write messages.
+
+usage: python benchmarks/bench_ism8.py [--save-baseline] [--threshold 0.3]
+
+Results are reported as operations (datapoints, frames) per second and peak
+traced bytes per operation: the tracemalloc peak of one call divided by the
+operations of the call. This is not a count of allocations. Without
+--save-baseline, results are compared to benchmarks/baseline.json and the
+script fails if a benchmark is slower than the baseline by more than the
+threshold. For this comparison, throughput is normalized by a reference
+workload measured alongside, using the median of the repeated rounds.
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import wolf_ism8 as wolf  # noqa: E402
+import wolf_ism8.ism8_simulator as sim  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+class NullTransport:
+    """discards everything written by Ism8"""
+
+    def write(self, data):
+        pass
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 12004)
+
+    def close(self):
+        pass
+
+
+def connected_ism8() -> wolf.Ism8:
+    ism8 = wolf.Ism8()
+    ism8.connection_made(NullTransport())
+    return ism8
+
+
+def _reference():
+    """fixed pure python workload, to normalize results for machine speed"""
+    table = {i: i for i in range(64)}
+    total = 0
+    for i in range(200):
+        total += table[i & 63] * 256 + (i >> 2)
+    return total
+
+
+def _rate(func, ops_per_call: int, min_time: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for _ in range(10):
+            func()
+        calls += 10
+        elapsed = time.perf_counter() - start
+    return calls * ops_per_call / elapsed
+
+
+def measure(func, ops_per_call: int, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """
+    runs func for at least min_time, <repeat> times. Returns ops/s of the
+    best round, the median of ops/s relative to a reference workload measured
+    right before each round (compared against the baseline, so results are
+    comparable across machines and CPU frequency changes) and the peak of
+    traced memory per op
+    """
+    func()
+    best = 0.0
+    relative = []
+    for _ in range(repeat):
+        reference = _rate(_reference, 1, min_time)
+        rate = _rate(func, ops_per_call, min_time)
+        best = max(best, rate)
+        relative.append(rate / reference)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ops_per_s": best,
+        "relative": statistics.median(relative),
+        "peak_bytes_per_op": peak / ops_per_call,
+    }
+
+
+def bench_float_codec() -> dict:
+    raw_values = [
+        int.from_bytes(wolf.encode_Float(t / 10), "big") for t in range(-200, 800)
+    ]
+    floats = [t / 10 for t in range(-200, 800)]
+
+    def decode():
+        for raw in raw_values:
+            wolf.decode_Float(raw)
+
+    def encode():
+        for value in floats:
+            wolf.encode_Float(value)
+
+    def decode_table():
+        for raw in raw_values:
+            wolf.decode_Float_table(raw)
+
+    def encode_table():
+        for value in floats:
+            wolf.encode_Float_table(value)
+
+    return {
+        "decode_Float": measure(decode, len(raw_values)),
+        "encode_Float": measure(encode, len(floats)),
+        "decode_Float_table": measure(decode_table, len(raw_values)),
+        "encode_Float_table": measure(encode_table, len(floats)),
+    }
+
+
+def bench_decode_datapoint() -> dict:
+    """decodes one datapoint of every datatype"""
+    ism8 = wolf.Ism8()
+    results = {}
+    for dp_type in wolf.DATATYPES:
+        dp_ids = [dp for dp, props in wolf.DATAPOINTS.items() if props[2] == dp_type]
+        if not dp_ids:
+            continue
+        dp_id = dp_ids[0]
+        raw = sim.default_raw_value(dp_id)
+
+        def decode(dp_id=dp_id, raw=raw):
+            for _ in range(100):
+                ism8.decode_datapoint(dp_id, raw)
+
+        results[f"decode_datapoint[{dp_type}]"] = measure(decode, 100)
+    return results
+
+
+def bench_data_received() -> dict:
+    float_ids = [
+        dp for dp, props in wolf.DATAPOINTS.items() if props[2] == "DPT_Value_Temp"
+    ]
+    single = bytes(sim.build_dp_frame([(float_ids[0], wolf.encode_Float(21.5))]))
+    frame = bytes(
+        sim.build_dp_frame([(dp, wolf.encode_Float(21.5)) for dp in float_ids[:20]])
+    )
+    coalesced = frame * 20
+    full_dump = b"".join(
+        bytes(sim.build_dp_frame(chunk))
+        for chunk in _chunks(
+            [(dp, sim.default_raw_value(dp)) for dp in sorted(wolf.DATAPOINTS)], 50
+        )
+    )
+    ism8 = connected_ism8()
+    return {
+        "data_received[single]": measure(lambda: ism8.data_received(single), 1),
+        "data_received[coalesced]": measure(
+            lambda: ism8.data_received(coalesced), 20 * 20
+        ),
+        "data_received[full_dump]": measure(
+            lambda: ism8.data_received(full_dump), len(wolf.DATAPOINTS)
+        ),
+    }
+
+
+def bench_send_dp_value() -> dict:
+    ism8 = connected_ism8()
+    return {
+        "send_dp_value[float]": measure(lambda: ism8.send_dp_value(56, 51.5), 1),
+        "send_dp_value[mode]": measure(lambda: ism8.send_dp_value(57, "Standby"), 1),
+    }
+
+
+def _chunks(items: list, size: int):
+    for ptr in range(0, len(items), size):
+        yield items[ptr : ptr + size]
+
+
+def run() -> dict:
+    results = {}
+    for bench in (
+        bench_float_codec,
+        bench_decode_datapoint,
+        bench_data_received,
+        bench_send_dp_value,
+    ):
+        results.update(bench())
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """returns names of benchmarks slower than baseline by more than threshold"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if result["relative"] < baseline[name]["relative"] * (1 - threshold):
+            regressions.append(name)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.3)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = run()
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as file:
+            baseline = json.load(file)
+
+    print(f"{'benchmark':48} {'ops/s':>12} {'peak traced B/op':>16} {'baseline':>9}")
+    for name, result in results.items():
+        ratio = ""
+        if name in baseline:
+            ratio = f"{result['relative'] / baseline[name]['relative']:8.2f}x"
+        print(
+            f"{name:48} {result['ops_per_s']:12.0f} "
+            f"{result['peak_bytes_per_op']:16.1f} {ratio:>9}"
+        )
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print(f"baseline saved to {BASELINE_FILE}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for name in regressions:
+        print(f"REGRESSION: {name} is more than {args.threshold:.0%} slower")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
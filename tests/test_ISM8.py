@@ -1,8 +1,10 @@
 import logging
 import asyncio
 import datetime
+import time
 import pytest
 import wolf_ism8 as wolf
+import wolf_ism8.ism8_simulator as sim
 
 
 @pytest.mark.asyncio
@@ -83,6 +85,100 @@ async def test_network_decoding(tst_ism8: wolf.Ism8, _LOGGER, caplog):
     assert tst_ism8._dp_values[178] == pytest.approx(0.1)
 
 
+@pytest.mark.asyncio
+async def test_split_network_msg(tst_ism8: wolf.Ism8, _LOGGER):
+    """frames split across TCP segments are reassembled, garbage is skipped"""
+    frame = bytearray(
+        b"\x06\x20\xf0\x80\x00\x16\x04\x00\x00\x00\xf0\x06\x00\xb4\x00\x01\x00\xb4\x03\x02\x02\x62"
+    )
+    _LOGGER.debug("trying to decode a frame split into two segments")
+    assert tst_ism8.data_received(frame[:13]) is True
+    assert 180 not in tst_ism8._dp_values.keys()
+    assert tst_ism8.data_received(frame[13:]) is True
+    assert tst_ism8._dp_values[180] == pytest.approx(6.1)
+    assert len(tst_ism8._rx_buffer) == 0
+
+    _LOGGER.debug("trying to decode a frame with split header and leading garbage")
+    frame[21] = 0x63
+    assert tst_ism8.data_received(b"\x01\x02\x06\x20") is False
+    assert tst_ism8.data_received(frame[2:8]) is True
+    assert tst_ism8.data_received(frame[8:] + b"\xff\xff") is True
+    assert tst_ism8._dp_values[180] == pytest.approx(6.11)
+
+    _LOGGER.debug("trying to decode two frames with garbage in between")
+    second = bytearray(frame)
+    second[21] = 0x64
+    assert tst_ism8.data_received(frame + b"\x00\x01" + second) is True
+    assert tst_ism8._dp_values[180] == pytest.approx(6.12)
+    assert len(tst_ism8._rx_buffer) == 0
+
+
+@pytest.mark.asyncio
+async def test_decode_frame(tst_ism8: wolf.Ism8):
+    """a compound message is decoded into one batch of updates"""
+    msg = b"\xf0\x06\x00\xb2\x00\x03\x00\xb2\x03\x02\x02\x62\x00\xb3\x03\x02\x02\x63\x27\x0f\x03\x01\x01"
+    updates = wolf.decode_frame(msg)
+    assert [u.dp_id for u in updates] == [178, 179]
+    assert updates[0].value == pytest.approx(6.1)
+    # zero length datapoint makes the whole message faulty
+    assert wolf.decode_frame(msg[:-5] + b"\x00\xb4\x03\x00") is None
+    assert wolf.decode_frame(msg[:-3]) is None
+
+    batches = []
+    tst_ism8.register_batch_callback(batches.append)
+    assert tst_ism8.process_object_server_msg(msg) is True
+    tst_ism8.remove_batch_callback(batches.append)
+    assert len(batches) == 1 and len(batches[0]) == 2
+    assert tst_ism8._dp_values[179] == pytest.approx(6.11)
+
+
+@pytest.mark.asyncio
+async def test_float_tables():
+    """table based float codec yields the same results as the calculation"""
+    for raw in range(0x10000):
+        assert wolf.decode_Float_table(raw) == wolf.decode_Float(raw)
+    for value in (51.5, 20.0, 20, -4.0, 0.5, 123.45, -0.01):
+        assert wolf.encode_Float_table(value) == wolf.encode_Float(value)
+    assert wolf.DP_DECODERS[4] is wolf.decode_Float_table
+    wolf.enable_float_table(False)
+    assert wolf.DP_DECODERS[4] is wolf.decode_Float
+    wolf.enable_float_table()
+
+
+@pytest.mark.asyncio
+async def test_float_tables_keep_custom_codecs(restore_codecs):
+    """switching the float tables keeps codecs registered by the user"""
+    wolf.register_codec("DPT_Tempd", wolf.decode_Int, None)
+    wolf.enable_float_table(False)
+    assert wolf.DP_DECODERS[65] is wolf.decode_Int
+    assert wolf.DP_DECODERS[4] is wolf.decode_Float
+    wolf.enable_float_table()
+    assert wolf.DP_DECODERS[65] is wolf.decode_Int
+    assert wolf.DP_DECODERS[4] is wolf.decode_Float_table
+
+
+@pytest.mark.asyncio
+async def test_bulk_decoding():
+    """large messages are decoded in groups with identical results"""
+    values = {dp: sim.default_raw_value(dp) for dp in wolf.DATAPOINTS}
+    # invalid float, power out of range and unknown datapoint are skipped
+    values.update({4: b"\x07\xff", 147: wolf.encode_Float(2000.0), 9999: b"\x01"})
+    values = list(values.items())
+    msg = sim.build_dp_frame(values)[10:]
+    updates = wolf.decode_frame(msg)
+    assert len(updates) >= wolf.BULK_MIN_DATAPOINTS
+    expected = [
+        (dp, wolf.decode_value(dp, raw))
+        for dp, raw in values
+        if wolf.decode_value(dp, raw) is not None
+    ]
+    assert updates == expected
+    assert len(updates) == len(values) - 3
+    assert wolf.decode_frame(msg[:-1]) is None
+    values[10] = (values[10][0], b"")
+    assert wolf.decode_frame(sim.build_dp_frame(values)[10:]) is None
+
+
 @pytest.mark.asyncio
 async def test_date_implementation(tst_ism8: wolf.Ism8, _LOGGER):
     """test of date implementation"""
@@ -218,6 +314,22 @@ async def test_write_DHWMode(tst_ism8: wolf.Ism8):
     assert wolf.validate_dp_range(58, "LegioProtect") is False
 
 
+@pytest.mark.asyncio
+async def test_precomputed_validation(caplog):
+    """reverse mode maps and value bounds are precomputed"""
+    assert wolf.reverse_modes(wolf.DHWModes)["Standby"] == 4
+    assert wolf.encode_dict("Standby", wolf.DHWModes) == b"\x04"
+    assert wolf.encode_dict("B", {0: "A", 1: "B", 2: "B"}) is None
+    assert wolf.DP_VALUE_BOUNDS[56] == (20, 80)
+    assert wolf.validate_dp_range(56, 51.8) is True
+    assert wolf.validate_dp_range(65, 1.2) is True
+    assert "Standby" in wolf.DP_VALUES_ALLOWED_SET[58]
+    assert wolf.validate_dp_range(56, 80.5) is False
+    assert "[20, 80]" in caplog.text
+    assert wolf.validate_dp_range(58, "Reduced") is False
+    assert "Dauerbetrieb" in caplog.text
+
+
 @pytest.mark.asyncio
 async def test_HVACCONTRMode(tst_ism8: wolf.Ism8):
     """
@@ -239,11 +351,745 @@ async def test_HVACCONTRMode(tst_ism8: wolf.Ism8):
     assert tst_ism8.encode_datapoint("Frostschutz", 177) == b"\x0b"
 
 
+@pytest.mark.asyncio
+async def test_decode_fallback(caplog, monkeypatch):
+    """datatypes without codec are decoded as INT, logged once per datatype"""
+    monkeypatch.setattr(wolf.ism8_codecs, "_FALLBACK_LOGGED", set())
+    caplog.set_level(logging.INFO)
+    assert wolf.decode_value(336, b"\x00\x05") == 5
+    assert wolf.decode_value(337, b"\x00\x06") == 6
+    assert wolf.decode_value(251, b"\x07") == 7
+    messages = [r.getMessage() for r in caplog.records if "fallback" in r.message]
+    assert messages == [
+        "datatype <DPT_unknown> of dp 336 not implemented, fallback to INT.",
+        "datatype <DPT_Value_1_Ucount> of dp 251 not implemented, fallback to INT.",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_codec_registry(tst_ism8: wolf.Ism8, restore_codecs):
+    """
+    372 Letzter Stoercode DPT_Value_1_Ucount, no codec registered by default
+    """
+    assert wolf.get_codec("DPT_Value_1_Ucount") == (None, None)
+    assert tst_ism8.encode_datapoint(3, 372) is None
+    wolf.register_codec(
+        "DPT_Value_1_Ucount", wolf.decode_Int, lambda x: bytearray([x & 0xFF])
+    )
+    assert wolf.DP_DECODERS[372] is wolf.decode_Int
+    assert tst_ism8.encode_datapoint(3, 372) == b"\x03"
+    tst_ism8.decode_datapoint(372, bytearray(b"\x2a"))
+    assert tst_ism8._dp_values[372] == 42
+
+
+@pytest.mark.asyncio
+async def test_send_many(connected_ism8, monkeypatch):
+    """several datapoints are packed into one message, invalid ones reported"""
+    ism8, transport = connected_ism8
+    values = {56: 51.5, 57: "Standby", 58: "GibtsNicht", 4: 20.0, 72: 1, 99999: 1}
+    transmitted, failed = ism8.send_many(values)
+    assert transmitted == [56, 57, 72]
+    assert failed == [58, 4, 99999]
+    assert len(transport.written) == 1
+    msg = transport.written[0]
+    assert len(msg) == 256 * msg[4] + msg[5]
+    # start datapoint and number of datapoints
+    assert msg[12:16] == b"\x00\x38\x00\x03"
+    assert ism8.read_sensor(57) == "Standby"
+
+    # many datapoints are split into several messages
+    monkeypatch.setattr(wolf.ism8, "ISM_MAX_FRAME_SIZE", 64)
+    transport.written.clear()
+    values = {
+        dp: 0
+        for dp in wolf.DP_VALUES_ALLOWED
+        if wolf.Ism8.get_type(dp) == "DPT_Switch" and wolf.Ism8.is_writable(dp)
+    }
+    transmitted, failed = ism8.send_many(values)
+    assert not failed and len(transmitted) == len(values)
+    assert len(transport.written) > 1
+    assert all(len(msg) <= 64 for msg in transport.written)
+
+
+@pytest.mark.asyncio
+async def test_async_send_dp_value(connected_ism8):
+    """writes are confirmed by the value reported back from ISM8"""
+    ism8, transport = connected_ism8
+    task = asyncio.create_task(ism8.async_send_dp_value(56, 51.5))
+    await asyncio.sleep(0)
+    assert len(transport.written) == 1
+    assert ism8.read_sensor(56) is None
+    ism8.data_received(incoming_frame({56: wolf.encode_Float(51.5)}))
+    assert await task is True
+    assert ism8.read_sensor(56) == pytest.approx(51.5, abs=0.05)
+    assert not ism8._pending_writes
+
+    # unconfirmed writes are repeated and finally fail
+    transport.written.clear()
+    assert await ism8.async_send_dp_value(57, "Standby", 0.01, 1) is False
+    assert len(transport.written) == 2
+    assert ism8.read_sensor(57) is None
+    assert await ism8.async_send_dp_value(57, "Comfort") is False
+
+
+@pytest.mark.asyncio
+async def test_multi_gateway_server():
+    """every gateway gets its own state, reconnects keep the state"""
+    hub = wolf.Ism8Server()
+    server = await asyncio.get_running_loop().create_server(hub.factory, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    new_gateways = []
+    hub.register_gateway_callback(lambda gw, ism8: new_gateways.append(gw))
+
+    _, writer1 = await asyncio.open_connection("127.0.0.1", port)
+    writer1.write(incoming_frame({8: wolf.encode_Float(5.0)}))
+    await writer1.drain()
+    # second gateway with another peer address, without binding a second IP
+    transport2 = FakeTransport(peer="192.168.1.21")
+    hub.factory().connection_made(transport2)
+    transport2.protocol.data_received(incoming_frame({8: wolf.encode_Float(-3.0)}))
+    await asyncio.sleep(0.1)
+    assert sorted(hub.get_gateways()) == ["127.0.0.1", "192.168.1.21"]
+    assert new_gateways == hub.get_gateways()
+    assert hub.read_sensor("127.0.0.1", 8) == pytest.approx(5.0)
+    assert hub.read_sensor("192.168.1.21", 8) == pytest.approx(-3.0)
+    assert hub.read_sensor("10.0.0.1", 8) is None
+
+    # gateway 1 reconnects before the old connection is closed
+    ism8 = hub.get_gateway("127.0.0.1")
+    _, writer3 = await asyncio.open_connection("127.0.0.1", port)
+    await asyncio.sleep(0.1)
+    writer1.close()
+    await asyncio.sleep(0.1)
+    assert hub.get_gateway("127.0.0.1") is ism8
+    assert ism8.connected()
+    assert hub.read_sensor("127.0.0.1", 8) == pytest.approx(5.0)
+    assert hub.send_dp_value("127.0.0.1", 56, 50.0) is True
+    assert len(new_gateways) == 2
+
+    writer3.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_trace(connected_ism8):
+    """raw frames are recorded in a ring buffer while trace is enabled"""
+    ism8, _ = connected_ism8
+    frame = incoming_frame({8: wolf.encode_Float(5.0)})
+    ism8.data_received(frame)
+    assert ism8.get_trace() == []
+    ism8.enable_trace(3)
+    for _ in range(3):
+        ism8.data_received(frame)
+    trace = ism8.get_trace()
+    # each received frame is acknowledged, oldest frames are dropped
+    assert len(trace) == 3
+    assert [line.split()[1] for line in trace] == ["tx", "rx", "tx"]
+    assert trace[1].split()[2] == frame.hex(":")
+    ism8.disable_trace()
+    assert ism8.get_trace() == []
+
+
+@pytest.mark.asyncio
+async def test_notification_filter(connected_ism8):
+    """callbacks only fire on changes beyond the deadband or on heartbeat"""
+    flt = wolf.NotificationFilter(max_interval=60)
+    flt.set_deadband(0.1, dp_type="DPT_Value_Temp")
+    assert flt.should_notify(8, 5.0, now=0) is True
+    assert flt.should_notify(8, 5.05, now=1) is False
+    assert flt.should_notify(8, 5.2, now=2) is True
+    assert flt.should_notify(8, 5.2, now=30) is False
+    assert flt.should_notify(8, 5.2, now=62) is True
+    assert flt.should_notify(57, "Standby", now=0) is True
+    assert flt.should_notify(57, "Standby", now=1) is False
+    flt.set_interval(min_interval=10)
+    assert flt.should_notify(57, "Heizbetrieb", now=5) is False
+    assert flt.should_notify(57, "Heizbetrieb", now=11) is True
+
+    ism8, _ = connected_ism8
+    calls = []
+    ism8.register_callback(lambda: calls.append(8), 8)
+    ism8.set_notification_filter(wolf.NotificationFilter())
+    for value in (5.0, 5.0, 5.5):
+        ism8.data_received(incoming_frame({8: wolf.encode_Float(value)}))
+    assert len(calls) == 2
+    assert ism8.read_sensor(8) == pytest.approx(5.5)
+
+    # a change within min_interval is notified when the interval has passed
+    ism8.set_notification_filter(wolf.NotificationFilter(min_interval=0.1))
+    calls.clear()
+    for value in (6.0, 6.5, 7.0):
+        ism8.data_received(incoming_frame({8: wolf.encode_Float(value)}))
+    assert len(calls) == 1
+    await asyncio.sleep(0.15)
+    assert len(calls) == 2
+    # a change back to the notified value cancels the trailing notification
+    for value in (7.5, 7.0):
+        ism8.data_received(incoming_frame({8: wolf.encode_Float(value)}))
+    await asyncio.sleep(0.15)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_subscriptions(connected_ism8):
+    """several subscribers per datapoint, by device, datatype and for all"""
+    ism8, _ = connected_ism8
+    calls = []
+    ism8.register_callback(lambda: calls.append("cb1"), 8)
+    ism8.register_callback(lambda: calls.append("cb2"), 8)
+    ism8.subscribe(lambda u: calls.append(("device", u.dp_id)), device="Heizgeraet1")
+    ism8.subscribe(lambda u: calls.append(("type", u.dp_id)), dp_type="DPT_Switch")
+
+    def on_all(update):
+        calls.append(("all", update.dp_id))
+
+    ism8.subscribe(on_all)
+    ism8.data_received(incoming_frame({8: wolf.encode_Float(5.0), 9: b"\x01"}))
+    assert calls == [
+        "cb1",
+        "cb2",
+        ("device", 8),
+        ("all", 8),
+        ("device", 9),
+        ("type", 9),
+        ("all", 9),
+    ]
+
+    calls.clear()
+    ism8.unsubscribe(on_all)
+    ism8.remove_callback(8)
+    ism8.data_received(incoming_frame({8: wolf.encode_Float(5.0)}))
+    assert calls == [("device", 8)]
+
+
+@pytest.mark.asyncio
+async def test_dispatch_queue(connected_ism8):
+    """async callbacks run in a worker task, the queue is bounded"""
+    ism8, transport = connected_ism8
+    received = []
+
+    async def slow_consumer(update):
+        await asyncio.sleep(0.01)
+        received.append(update.value)
+
+    ism8.subscribe(slow_consumer, dp_id=8)
+    queue = ism8.enable_dispatch_queue(maxsize=2, overflow=wolf.DISPATCH_COALESCE)
+    for value in (1.0, 2.0, 3.0):
+        ism8.data_received(incoming_frame({8: wolf.encode_Float(value)}))
+    # protocol handling does not wait for the consumer
+    assert len(transport.written) == 3
+    assert received == []
+    await queue.join()
+    assert received == [pytest.approx(3.0)]
+    assert queue.coalesced == 2
+
+    received.clear()
+    queue = ism8.enable_dispatch_queue(maxsize=2, overflow=wolf.DISPATCH_DROP_OLDEST)
+    for value in (1.0, 2.0, 3.0):
+        ism8.data_received(incoming_frame({8: wolf.encode_Float(value)}))
+    await queue.join()
+    assert received == [pytest.approx(2.0), pytest.approx(3.0)]
+    assert queue.dropped == 1
+
+    # backpressure pauses reading from ISM8 until the queue is drained
+    received.clear()
+    queue = ism8.enable_dispatch_queue(maxsize=2, overflow=wolf.DISPATCH_BACKPRESSURE)
+    for value in (1.0, 2.0, 3.0):
+        ism8.data_received(incoming_frame({8: wolf.encode_Float(value)}))
+    assert transport.paused is True
+    await queue.join()
+    assert transport.paused is False
+    assert len(received) == 3
+    # stopping a paused queue resumes reading
+    for value in (1.0, 2.0, 3.0):
+        ism8.data_received(incoming_frame({8: wolf.encode_Float(value)}))
+    assert transport.paused is True
+    ism8.disable_dispatch_queue()
+    assert transport.paused is False
+
+    # without queue, coroutine callbacks are scheduled as tasks
+    received.clear()
+    ism8.data_received(incoming_frame({8: wolf.encode_Float(4.0)}))
+    await asyncio.sleep(0.05)
+    assert received == [pytest.approx(4.0)]
+
+
+@pytest.mark.asyncio
+async def test_datapoint_store(connected_ism8):
+    """values are stored with update time and quality"""
+    store = wolf.DatapointStore()
+    assert 8 not in store and len(store) == 0
+    store.set(8, 5.0, timestamp=100.0)
+    store[9] = True
+    assert store[8] == 5.0 and store.get(9) is True and len(store) == 2
+    assert list(store.keys()) == [8, 9]
+    assert store.get_with_age(8, now=130.0) == (5.0, 30.0)
+    assert store.get_with_age(10) == (None, None)
+    assert store.get_quality(8) == wolf.QUALITY_GOOD
+    store.set_quality(wolf.QUALITY_STALE)
+    assert store.snapshot([8]) == [(8, 5.0, 100.0, wolf.QUALITY_STALE)]
+    del store[9]
+    assert 9 not in store and store.get_quality(9) == wolf.QUALITY_UNKNOWN
+    with pytest.raises(KeyError):
+        store[100000] = 1
+
+    ism8, _ = connected_ism8
+    assert ism8.read_sensor_with_age(8) == (None, None)
+    ism8.data_received(incoming_frame({8: wolf.encode_Float(5.0)}))
+    value, age = ism8.read_sensor_with_age(8)
+    assert value == pytest.approx(5.0) and 0 <= age < 1
+    assert [state.dp_id for state in ism8.get_snapshot()] == [8]
+
+
+@pytest.mark.asyncio
+async def test_history(connected_ism8):
+    """ring buffer keeps the last values, window queries over time"""
+    history = wolf.DatapointHistory(depth=4)
+    assert history.stats() is None
+    for t in range(6):
+        history.append(float(t), float(t * 10))
+    assert len(history) == 4
+    assert history.samples() == [(2.0, 20.0), (3.0, 30.0), (4.0, 40.0), (5.0, 50.0)]
+    assert history.stats(seconds=2, now=5.0) == (30.0, 50.0, 40.0)
+    assert history.samples(seconds=0.5, now=5.0) == [(5.0, 50.0)]
+
+    ism8, _ = connected_ism8
+    assert ism8.get_history(8) is None
+    ism8.enable_history(depth=10)
+    for value in (5.0, 6.0):
+        ism8.data_received(incoming_frame({8: wolf.encode_Float(value)}))
+    ism8.data_received(
+        incoming_frame({57: wolf.encode_dict("Standby", wolf.HVACModes)})
+    )
+    assert [v for _, v in ism8.get_history(8).samples()] == [5.0, 6.0]
+    assert ism8.get_history(57) is None
+
+
+@pytest.mark.asyncio
+async def test_history_numpy():
+    numpy = pytest.importorskip("numpy")
+    history = wolf.DatapointHistory(depth=3)
+    for t in range(5):
+        history.append(float(t), float(t))
+    timestamps, values = history.as_numpy()
+    assert numpy.array_equal(values, [2.0, 3.0, 4.0])
+    assert history.stats(seconds=1, now=4.0) == (3.0, 4.0, 3.5)
+
+
+@pytest.mark.asyncio
+async def test_capture_replay(connected_ism8, tmp_path):
+    """captured traffic can be replayed into another instance"""
+    ism8, _ = connected_ism8
+    path = tmp_path / "traffic.cap"
+    frame = incoming_frame({8: wolf.encode_Float(5.0), 9: b"\x01"})
+    with wolf.CaptureWriter(path) as writer:
+        ism8.enable_capture(writer)
+        ism8.data_received(frame[:7])
+        ism8.data_received(frame[7:])
+        ism8.disable_capture()
+    records = [(r.direction, r.peer, bytes(r.data)) for r in wolf.read_capture(path)]
+    # received chunks are recorded as they arrive, followed by the ACK
+    assert records[2][0] == wolf.DIRECTION_TX
+    assert records[2][2][10:12] == wolf.ISM_SERVICE_ACK
+    assert records[:2] == [
+        (wolf.DIRECTION_RX, "192.168.1.20", frame[:7]),
+        (wolf.DIRECTION_RX, "192.168.1.20", frame[7:]),
+    ]
+
+    replayed = wolf.Ism8()
+    assert wolf.replay_capture(path, replayed) == 2
+    assert replayed.read_sensor(8) == pytest.approx(5.0)
+    replayed = wolf.Ism8()
+    assert await wolf.async_replay_capture(path, replayed, speed=100) == 2
+    assert replayed.read_sensor(9) is True
+
+
+@pytest.mark.asyncio
+async def test_simulator():
+    """full dump, confirmed writes, split and malformed frames"""
+    ism8 = wolf.Ism8()
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(ism8.factory, "127.0.0.1", 0)
+    simulator = sim.Ism8Simulator(split_size=7)
+    await simulator.connect("127.0.0.1", server.sockets[0].getsockname()[1])
+    await asyncio.sleep(0.05)
+    assert ism8.connected()
+
+    ism8.request_all_datapoints()
+    await asyncio.sleep(0.2)
+    assert simulator.dump_requests == 1
+    assert len(ism8.get_snapshot()) == len(wolf.DATAPOINTS)
+    assert simulator.acks_received == simulator.frames_sent
+
+    assert await ism8.async_send_dp_value(56, 45.0, timeout=1) is True
+    assert simulator.writes_received == 1
+
+    for kind in (
+        sim.MALFORMED_GARBAGE,
+        sim.MALFORMED_ZERO_LENGTH,
+        sim.MALFORMED_TRUNCATED,
+        sim.MALFORMED_BROKEN_HEADER,
+    ):
+        await simulator.inject_malformed(kind)
+    await simulator.storm(3, dp_ids=[4, 5])
+    await asyncio.sleep(0.2)
+    assert ism8.read_sensor(5) == pytest.approx(20.2)
+
+    await simulator.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_metadata_indexes():
+    """metadata queries use indexes built at import"""
+    assert "Heizgeraet1" in wolf.Ism8.get_all_devices()
+    heizgeraet1 = wolf.Ism8.get_datapoints_for_device("Heizgeraet1")
+    assert heizgeraet1[:13] == tuple(range(1, 14))
+    assert 4 in wolf.Ism8.get_datapoints_for_type("DPT_Value_Temp")
+    assert wolf.Ism8.get_datapoints_for_device("GibtsNicht") == ()
+    assert 56 in wolf.Ism8.get_writable_datapoints()
+    assert wolf.Ism8.is_writable(56) and not wolf.Ism8.is_writable(4)
+    assert wolf.Ism8.get_unit(4) == "C" and wolf.Ism8.get_unit(9999) == ""
+    assert wolf.Ism8.first_fw_version(200) == "1.50"
+    assert wolf.Ism8.first_fw_version(365) == "1.80"
+    assert wolf.Ism8.first_fw_version(1) == "1.00"
+    fw_150 = wolf.Ism8.get_datapoints_for_firmware("1.50")
+    assert 200 in fw_150 and 365 not in fw_150
+    assert 365 in wolf.Ism8.get_datapoints_for_firmware("1.90")
+    assert wolf.Ism8.get_datapoints_for_firmware("1.00") < fw_150
+    assert wolf.Ism8.get_datapoints_for_firmware("1.8") == (
+        wolf.Ism8.get_datapoints_for_firmware("1.80")
+    )
+    assert wolf.Ism8.get_datapoints_for_firmware("abc") == frozenset()
+
+
+@pytest.mark.asyncio
+async def test_firmware_filtering(caplog):
+    """datapoints unsupported by the firmware are neither stored nor logged"""
+    ism8 = wolf.Ism8(firmware_version="1.50")
+    transport = FakeTransport()
+    ism8.connection_made(transport)
+    assert ism8.get_firmware_version() == "1.50"
+    assert not ism8.subscribe(lambda update: None, dp_id=365)
+    assert ism8.subscribe(lambda update: None, dp_id=200)
+    caplog.set_level(logging.INFO)
+    frame = incoming_frame({4: wolf.encode_Float(60.0), 365: wolf.encode_Float(55.0)})
+    assert ism8.data_received(frame)
+    assert ism8.read_sensor(4) == pytest.approx(60.0)
+    assert ism8.read_sensor(365) is None
+    assert "unknown datapoint" not in caplog.text
+    assert ism8.send_many({210: 50.0, 204: 50.0}) == ([204], [210])
+    written = len(transport.written)
+    assert ism8.send_dp_value(210, 50.0) is False
+    assert len(transport.written) == written
+    assert [dp_id for dp_id, *_ in ism8.get_snapshot()] == [4, 204]
+
+
+@pytest.mark.asyncio
+async def test_firmware_detection(monkeypatch):
+    """firmware version is derived from the received datapoints"""
+    ism8 = wolf.Ism8()
+    assert ism8.detect_firmware_version() is None
+    frame = incoming_frame({4: wolf.encode_Float(60.0), 200: wolf.encode_Float(80.0)})
+    ism8.data_received(frame)
+    assert ism8.detect_firmware_version() == "1.50"
+    assert ism8.read_sensor(200) == pytest.approx(80.0)
+    assert not ism8.set_firmware_version("0.10")
+    assert not ism8.set_firmware_version("abc")
+    assert wolf.Ism8("1.x").get_firmware_version() is None
+
+    monkeypatch.setattr(wolf.ism8, "ISM_FW_DETECT_DELAY", 0.01)
+    ism8 = wolf.Ism8(wolf.ISM_FW_AUTO)
+    calls = []
+    assert ism8.register_callback(lambda: calls.append(365), 365)
+    transport = FakeTransport()
+    ism8.connection_made(transport)
+    ism8.data_received(incoming_frame({200: wolf.encode_Float(80.0)}))
+    await asyncio.sleep(0.05)
+    assert ism8.get_firmware_version() == "1.50"
+    # after a firmware update, the version is detected again on reconnect
+    ism8.connection_lost(None)
+    ism8.connection_made(transport)
+    assert ism8.get_firmware_version() is None
+    ism8.data_received(incoming_frame({365: wolf.encode_Float(55.0)}))
+    await asyncio.sleep(0.05)
+    assert ism8.get_firmware_version() == "1.80"
+    assert ism8.read_sensor(365) == pytest.approx(55.0)
+    # the subscription survived the detection of "1.50"
+    ism8.data_received(incoming_frame({365: wolf.encode_Float(56.0)}))
+    assert calls == [365, 365]
+    # None allows all datapoints and stops the detection
+    assert ism8.set_firmware_version(None)
+    ism8.connection_made(transport)
+    await asyncio.sleep(0.05)
+    assert ism8.get_firmware_version() is None
+
+
+@pytest.mark.asyncio
+async def test_supervision(connected_ism8):
+    """silence marks values stale, reconnect requests a rate-limited resync"""
+    ism8, transport = connected_ism8
+    ism8.data_received(incoming_frame({8: wolf.encode_Float(5.0)}))
+    supervisor = ism8.enable_supervision(silence_timeout=0.05, resync_interval=10.0)
+    assert transport.written[-1] == wolf.ISM_REQ_DP_MSG
+    assert ism8.get_snapshot([8])[0].quality == wolf.QUALITY_UNKNOWN
+    ism8.data_received(incoming_frame({8: wolf.encode_Float(6.0)}))
+    assert ism8.get_snapshot([8])[0].quality == wolf.QUALITY_GOOD
+
+    await asyncio.sleep(0.1)
+    assert supervisor.is_stale() and supervisor.stale_events == 1
+    assert ism8.get_snapshot([8])[0].quality == wolf.QUALITY_STALE
+    # the probe is rate-limited
+    assert supervisor.resyncs == 1
+
+    ism8.connection_lost(None)
+    ism8.connection_made(transport)
+    assert supervisor.resyncs == 1 and not supervisor.is_stale()
+    supervisor.check(supervisor.last_frame + 10.0)
+    assert supervisor.resyncs == 2
+    assert transport.written.count(wolf.ISM_REQ_DP_MSG) == 2
+    ism8.disable_supervision()
+
+
+@pytest.mark.asyncio
+async def test_incremental_resync():
+    """only stale datapoints are requested, in merged ranges"""
+    assert wolf.plan_ranges([20, 3, 4, 9, 30], max_gap=4) == [(3, 7), (20, 1), (30, 1)]
+    ism8 = wolf.Ism8()
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(ism8.factory, "127.0.0.1", 0)
+    simulator = sim.Ism8Simulator()
+    await simulator.connect("127.0.0.1", server.sockets[0].getsockname()[1])
+    await asyncio.sleep(0.05)
+
+    assert ism8.refresh_stale() == 1
+    await asyncio.sleep(0.2)
+    assert simulator.dump_requests == 1
+    assert ism8.refresh_stale() == 0
+
+    for dp_id in (4, 5, 100):
+        ism8._dp_values.set_quality(wolf.QUALITY_STALE, dp_id)
+    acks = simulator.acks_received
+    assert ism8.refresh_stale() == 2
+    await asyncio.sleep(0.1)
+    assert simulator.value_requests == 2 and simulator.dump_requests == 1
+    assert ism8.get_snapshot([4])[0].quality == wolf.QUALITY_GOOD
+    assert ism8.get_snapshot([100])[0].quality == wolf.QUALITY_GOOD
+    assert simulator.acks_received == acks
+
+    ism8._dp_values.set_quality(wolf.QUALITY_STALE)
+    assert ism8.refresh_stale() == 1
+    await asyncio.sleep(0.2)
+    assert simulator.dump_requests == 2
+
+    await simulator.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_write_queue(connected_ism8, monkeypatch):
+    """repeated writes within the window are coalesced, frames are paced"""
+    ism8, transport = connected_ism8
+    queue = ism8.enable_write_queue(window=0.05, min_interval=0.05, maxsize=2)
+    for value in (40.0, 41.0, 42.0, 43.0):
+        assert ism8.send_dp_value(56, value)
+    assert ism8.send_dp_value(204, 50.0)
+    assert not ism8.send_dp_value(210, 50.0)
+    assert transport.written == []
+    assert queue.qsize() == 2 and queue.coalesced == 3 and queue.dropped == 1
+    await queue.join()
+    assert len(transport.written) == 1 and queue.frames_sent == 1
+    frame = transport.written[0]
+    assert frame[14:16] == b"\x00\x02"
+    assert bytes(wolf.encode_Float(43.0)) in frame
+
+    # frames of later bursts keep min_interval
+    monkeypatch.setattr(wolf.ism8, "ISM_MAX_FRAME_SIZE", 24)
+    start = time.monotonic()
+    ism8.send_dp_value(56, 44.0)
+    ism8.send_dp_value(204, 51.0)
+    await queue.join()
+    assert len(transport.written) == 3
+    assert time.monotonic() - start >= 0.1
+    ism8.send_dp_value(56, 45.0)
+    ism8.connection_lost(None)
+    assert queue.qsize() == 0 and queue.dropped == 2
+    ism8.disable_write_queue()
+
+
+@pytest.mark.asyncio
+async def test_metrics(connected_ism8):
+    """frames, drops and latencies are counted and exposed as text"""
+    ism8, transport = connected_ism8
+    ism8.subscribe(lambda update: None, dp_id=8)
+    ism8.data_received(incoming_frame({8: wolf.encode_Float(5.0), 9999: b"\x01"}))
+    ism8.data_received(incoming_frame({8: b"\x07\xff"}))
+    ism8.data_received(b"\x01\x02\x03\x04\x05")
+    ism8.data_received(incoming_frame({8: b""}))
+    metrics = ism8.get_metrics()
+    assert metrics["frames_received"] == 3 and metrics["frames_acked"] == 2
+    assert metrics["frames_dropped"] == {
+        wolf.DROP_UNKNOWN_DP: 1,
+        wolf.DROP_INVALID_VALUE: 1,
+        wolf.DROP_NO_HEADER: 1,
+        wolf.DROP_ZERO_LENGTH: 1,
+    }
+    # the first message is sampled
+    assert metrics["decode_latency"]["DPT_Value_Temp"]["count"] == 1
+    assert metrics["callback_latency"]["count"] == 1
+
+    text = ism8.get_metrics_text()
+    assert 'wolf_ism8_frames_received_total{gateway="192.168.1.20"} 3' in text
+    assert 'reason="unknown_dp"} 1' in text
+    assert 'dpt="DPT_Value_Temp",le="+Inf"} 1' in text
+    server = await wolf.serve_metrics(ism8.get_metrics_text, port=0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    assert response.startswith(b"HTTP/1.0 200 OK") and response.endswith(text.encode())
+
+
+@pytest.mark.asyncio
+async def test_profiler(connected_ism8):
+    """stage timings of received frames, slowest frames kept with raw bytes"""
+    ism8, transport = connected_ism8
+    assert ism8.get_profile() == []
+    profiler = ism8.enable_profiler(slowest=2)
+    timings = []
+    profiler.add_hook(lambda stage, seconds: timings.append(stage))
+    frames = [incoming_frame({8: wolf.encode_Float(value)}) for value in (1, 2, 3)]
+    ism8.subscribe(lambda update: time.sleep(0.01), dp_id=8)
+    ism8.data_received(frames[0])
+    ism8.unsubscribe(None, dp_id=8)
+    ism8.data_received(frames[1] + frames[2])
+    assert profiler.frames_profiled == 3
+    assert timings[:4] == [
+        wolf.STAGE_FRAMING,
+        wolf.STAGE_DECODE,
+        wolf.STAGE_STORE,
+        wolf.STAGE_CALLBACKS,
+    ]
+    slowest = ism8.get_profile()
+    assert len(slowest) == 2
+    assert slowest[0].frame == bytes(frames[0])
+    assert slowest[0].stages[wolf.STAGE_CALLBACKS] >= 0.01
+    assert slowest[0].total >= slowest[1].total
+    assert ism8.read_sensor(8) == pytest.approx(3.0)
+    ism8.disable_profiler()
+    assert ism8.get_profile() == []
+
+
+@pytest.mark.asyncio
+async def test_connection_lost_in_callback(connected_ism8):
+    """a callback may end the connection while a message is processed"""
+    ism8, transport = connected_ism8
+    ism8.subscribe(lambda update: ism8.connection_lost(None), dp_id=8)
+    frame = incoming_frame({8: wolf.encode_Float(5.0)})
+    assert ism8.data_received(frame + incoming_frame({5: wolf.encode_Float(6.0)}))
+    assert len(ism8._rx_buffer) == 0
+    assert ism8.read_sensor(8) == pytest.approx(5.0)
+    assert ism8.read_sensor(5) is None
+    ism8.connection_made(transport)
+    assert ism8.data_received(incoming_frame({5: wolf.encode_Float(6.0)}))
+    assert ism8.read_sensor(5) == pytest.approx(6.0)
+
+
+@pytest.mark.asyncio
+async def test_callback_raises(connected_ism8):
+    """frames after the one whose callback raised are still decoded and ACKed"""
+    ism8, transport = connected_ism8
+
+    def failing_callback(update):
+        raise RuntimeError("callback failed")
+
+    ism8.subscribe(failing_callback, dp_id=8)
+    frame = incoming_frame({8: wolf.encode_Float(5.0)})
+    with pytest.raises(RuntimeError):
+        ism8.data_received(frame + incoming_frame({5: wolf.encode_Float(6.0)}))
+    assert ism8.read_sensor(8) == pytest.approx(5.0)
+    assert ism8.data_received(incoming_frame({6: wolf.encode_Float(7.0)}))
+    assert ism8.read_sensor(5) == pytest.approx(6.0)
+    assert ism8.read_sensor(6) == pytest.approx(7.0)
+    assert len(transport.written) == 2
+
+    # asyncio ends the connection after the exception, the next one starts clean
+    with pytest.raises(RuntimeError):
+        ism8.data_received(frame + incoming_frame({5: wolf.encode_Float(1.0)}))
+    ism8.connection_lost(None)
+    ism8.connection_made(transport)
+    chunk = b"".join(
+        incoming_frame({dp_id: wolf.encode_Float(float(dp_id))}) for dp_id in (5, 6, 7)
+    )
+    assert ism8.data_received(chunk)
+    assert [ism8.read_sensor(dp_id) for dp_id in (5, 6, 7)] == [5.0, 6.0, 7.0]
+    assert len(ism8._rx_buffer) == 0
+
+
+@pytest.fixture
+def restore_codecs():
+    """restores the global codec registry after a test"""
+    tables = (wolf.DPT_CODECS, wolf.DP_DECODERS, wolf.DP_ENCODERS)
+    saved = [dict(table) for table in tables]
+    yield
+    for table, content in zip(tables, saved):
+        table.clear()
+        table.update(content)
+
+
 @pytest.fixture(scope="module")
 def tst_ism8():
     return wolf.Ism8()
 
 
+def incoming_frame(values: dict) -> bytearray:
+    """builds a message as sent by ISM8 for a dict dp_id -> encoded value"""
+    msg = wolf.Ism8().build_multi_message(list(values.items()))
+    msg[10:12] = wolf.ISM_SERVICE_RECEIVE
+    return msg
+
+
+class FakeTransport:
+    """records data written by Ism8 instead of sending it"""
+
+    def __init__(self, peer="192.168.1.20"):
+        self.written = []
+        self.peer = peer
+        self.paused = False
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def get_extra_info(self, name):
+        return (self.peer, 12004)
+
+    def close(self):
+        pass
+
+    def set_protocol(self, protocol):
+        self.protocol = protocol
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+
+@pytest.fixture
+def connected_ism8():
+    ism8 = wolf.Ism8()
+    transport = FakeTransport()
+    ism8.connection_made(transport)
+    return ism8, transport
+
+
 @pytest.fixture(scope="module")
 def _LOGGER():
     return logging.getLogger(__name__)
@@ -3,3 +3,4 @@ Module for gathering info from Wolf Heating System via ISM8 adapter
 """
 
 from .ism8 import *
+from .ism8_server import *
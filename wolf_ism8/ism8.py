@@ -4,8 +4,22 @@ Module for gathering info and sending commands from/to Wolf HVAC System via ISM8
 
 import logging
 import asyncio
+import collections
+import time
 from .ism8_constants import *
 from .ism8_helper_functions import *
+from .ism8_codecs import *
+from .ism8_metadata import *
+from .ism8_notify import *
+from .ism8_subscriptions import *
+from .ism8_dispatch import *
+from .ism8_store import *
+from .ism8_history import *
+from .ism8_capture import *
+from .ism8_supervisor import *
+from .ism8_writes import *
+from .ism8_metrics import *
+from .ism8_profiler import *
 
 
 class Ism8(asyncio.Protocol):
@@ -40,19 +54,12 @@ class Ism8(asyncio.Protocol):
     @staticmethod
     def get_unit(dp_id: int) -> str:
         """returns datapoint unit from static Dictionary"""
-        if dp_id in DATAPOINTS:
-            dp_type = DATAPOINTS[dp_id][IX_TYPE]
-            return DATATYPES[dp_type][DT_UNIT]
-        else:
-            return ""
+        return DP_UNITS.get(dp_id, "")
 
     @staticmethod
     def is_writable(dp_id) -> bool:
         """returns writable flag from static Dictionary"""
-        if dp_id in DATAPOINTS.keys():
-            return DATAPOINTS[dp_id][IX_RW_FLAG]
-        else:
-            return False
+        return dp_id in WRITABLE_DATAPOINTS
 
     @staticmethod
     def get_value_range(dp_id: int):
@@ -72,31 +79,75 @@ class Ism8(asyncio.Protocol):
     @staticmethod
     def get_all_devices():
         """returns list of all ISM8 devices. Unique first Component of DATAPOINTS"""
-        return sorted(set([x[0] for x in DATAPOINTS.values()]))
+        return list(ALL_DEVICES)
 
     @staticmethod
     def first_fw_version(dp_id: int) -> str:
         "returns first ISM8-firmware version of datapoint implementation"
-        if 191 < dp_id < 208:
-            return "1.50"
-        if dp_id in (209, 210, 211, 251):
-            return "1.70"
-        if 354 < dp_id < 362:
-            return "1.70"
-        if 363 < dp_id < 373:
-            return "1.80"
-        if 211 < dp_id < 251:
-            return "1.80"
-        return "1.00"
-
-    def __init__(self):
+        return first_fw_version(dp_id)
+
+    @staticmethod
+    def get_datapoints_for_device(device: str) -> tuple:
+        """returns ids of all datapoints of a device"""
+        return DEVICE_DATAPOINTS.get(device, ())
+
+    @staticmethod
+    def get_datapoints_for_type(dp_type: str) -> tuple:
+        """returns ids of all datapoints of a datatype"""
+        return DPT_DATAPOINTS.get(dp_type, ())
+
+    @staticmethod
+    def get_writable_datapoints() -> frozenset:
+        """returns ids of all writable datapoints"""
+        return WRITABLE_DATAPOINTS
+
+    @staticmethod
+    def get_datapoints_for_firmware(version: str) -> frozenset:
+        """returns ids of all datapoints supported by an ISM8-firmware version"""
+        return datapoints_for_firmware(version)
+
+    def __init__(self, firmware_version: str | None = None):
         # the datapoint-values from the device are stored and buffered here
-        self._dp_values = {}
+        self._dp_values = DatapointStore()
+        # datapoints supported by the ISM8-firmware, None for all datapoints
+        self._active_dps = None
+        self._firmware_version = None
+        # firmware version is detected after every connect, see ISM_FW_AUTO
+        self._detect_firmware = False
+        self._detect_handle = None
         self._transport = None
         self._remote_ip_address = None
         self._connected = False
-        # the callbacks for all datapoints are stored in a dictionary
-        self._callback_on_data = {}
+        # received bytes are buffered here until a complete frame is available
+        self._rx_buffer = bytearray()
+        # set if the buffer must be cleared after data_received
+        self._rx_reset = False
+        # the callbacks for all datapoints are stored in a subscription index
+        self._subscriptions = SubscriptionIndex()
+        # callbacks receiving all updates of one message at once
+        self._callback_on_batch = []
+        # writes waiting for confirmation: dp_id -> (expected value, future)
+        self._pending_writes = {}
+        # optional filter for callbacks, see set_notification_filter
+        self._notification_filter = None
+        # optional queue for calling callbacks outside of protocol handling
+        self._dispatch_queue = None
+        # optional queue coalescing and pacing writes of send_dp_value
+        self._write_queue = None
+        # history of numeric values, only if enabled
+        self._history = None
+        # writer for capturing network traffic, only if enabled
+        self._capture = None
+        # ring buffer of raw frames, only if trace is enabled
+        self._trace = None
+        # supervisor of the link to ISM8, only if supervision is enabled
+        self._supervisor = None
+        # counters and histograms, see get_metrics
+        self._metrics = Metrics()
+        # timing of processing stages, only if the profiler is enabled
+        self._profiler = None
+        if firmware_version is not None:
+            self.set_firmware_version(firmware_version)
         return
 
     def factory(self):
@@ -105,19 +156,121 @@ class Ism8(asyncio.Protocol):
     def get_remote_ip_adress(self):
         return self._remote_ip_address
 
+    def get_firmware_version(self) -> str | None:
+        """returns the ISM8-firmware version, None if not set or detected"""
+        return self._firmware_version
+
+    def set_firmware_version(self, version: str | None) -> bool:
+        """
+        restricts the datapoints to those supported by an ISM8-firmware
+        version. Other datapoints are neither stored nor decoded and cannot be
+        subscribed to or written. Values already received are kept.
+        None allows all datapoints again. With ISM_FW_AUTO, all datapoints are
+        allowed after every connect until the version has been detected
+        """
+        if version is None or version == ISM_FW_AUTO:
+            self._detect_firmware = version == ISM_FW_AUTO
+            self._restrict_datapoints(None, None)
+            if self._detect_firmware and self._connected:
+                self._schedule_detection()
+            return True
+        active = datapoints_for_firmware(version)
+        if not active:
+            Ism8.log.error(f"unknown ISM8 firmware version: {version}")
+            return False
+        self._detect_firmware = False
+        self._cancel_detection()
+        self._restrict_datapoints(version, active)
+        return True
+
+    def _restrict_datapoints(self, version: str | None, active) -> None:
+        """rebuilds store and subscriptions for the active datapoints"""
+        store = DatapointStore(active)
+        for state in self._dp_values.snapshot():
+            if active is None or state.dp_id in active:
+                store.set(*state)
+        self._dp_values = store
+        self._active_dps = active
+        self._subscriptions.set_active(active)
+        self._firmware_version = version
+        if active is not None:
+            Ism8.log.info(f"ISM8 firmware {version}: {len(active)} datapoints active")
+
+    def detect_firmware_version(self) -> str | None:
+        """
+        derives the firmware version from the datapoints received so far (the
+        first version supporting all of them) and restricts the datapoints to
+        it. Returns None if no datapoints have been received
+        """
+        if not self._dp_values:
+            return None
+        version = max(
+            (first_fw_version(dp_id) for dp_id in self._dp_values), key=version_key
+        )
+        self._restrict_datapoints(version, datapoints_for_firmware(version))
+        return version
+
+    def _schedule_detection(self) -> None:
+        # ISM8 sends all datapoints after connecting
+        self._cancel_detection()
+        self._detect_handle = asyncio.get_running_loop().call_later(
+            ISM_FW_DETECT_DELAY, self._auto_detect_firmware
+        )
+
+    def _cancel_detection(self) -> None:
+        if self._detect_handle is not None:
+            self._detect_handle.cancel()
+            self._detect_handle = None
+
+    def _auto_detect_firmware(self) -> None:
+        self._detect_handle = None
+        self.detect_firmware_version()
+
     def request_all_datapoints(self) -> None:
         """send 'request all datapoints' to ISM8"""
         req_msg = bytearray(ISM_REQ_DP_MSG)
         Ism8.log.debug("Sending REQ_ALL_DP: %s ", req_msg.hex(":"))
-        if self._transport:
-            self._transport.write(req_msg)  # type: ignore
+        self._write(req_msg)
+
+    def refresh_stale(self, max_age: float | None = None) -> int:
+        """
+        requests the values of stale datapoints from ISM8: values without
+        quality GOOD or, if max_age is given, older than max_age seconds. They
+        are requested in ranges with 'get datapoint value'. If most cached
+        values are stale (or none are cached), all datapoints are requested
+        instead. Returns the number of requests sent
+        """
+        now = time.monotonic()
+        states = self._dp_values.snapshot()
+        stale = [
+            state.dp_id
+            for state in states
+            if state.quality != QUALITY_GOOD
+            or (max_age is not None and now - state.timestamp > max_age)
+        ]
+        if not states or len(stale) > len(states) * ISM_REFRESH_FULL_RATIO:
+            self.request_all_datapoints()
+            return 1
+        ranges = plan_ranges(stale)
+        Ism8.log.debug(f"requesting {len(stale)} stale datapoints: {ranges}")
+        for start, count in ranges:
+            self._write(self.build_read_message(start, count))
+        return len(ranges)
 
     def connection_made(self, transport) -> None:
         """is called as soon as an ISM8 connects to server"""
         self._transport = transport
         self._connected = True
+        self._rx_reset = False
+        self._clear_rx_buffer()
         self._remote_ip_address = transport.get_extra_info("peername")[0]
         Ism8.log.info("Connection from ISM8: %s", self._remote_ip_address)
+        if self._detect_firmware:
+            # a firmware update may add datapoints, detect the version again
+            self._restrict_datapoints(None, None)
+            self._schedule_detection()
+        if self._supervisor is not None:
+            self._supervisor.connection_made()
 
     def connection_lost(self, exc):
         """
@@ -125,184 +278,458 @@ class Ism8(asyncio.Protocol):
         """
         Ism8.log.debug("ISM8 closed the connection. Stopping")
         self._connected = False
+        self._clear_rx_buffer()
+        self._cancel_detection()
+        if self._supervisor is not None:
+            self._supervisor.connection_lost()
+        if self._write_queue is not None:
+            self._write_queue.clear()
+        for _, future in self._pending_writes.values():
+            if not future.done():
+                future.set_result(False)
+        self._pending_writes.clear()
         if self._transport:
             self._transport.close()
 
-    def register_callback(self, cb, dp_nbr):
-        self._callback_on_data.update({dp_nbr: cb})
+    def register_callback(self, cb, dp_nbr) -> bool:
+        """cb is called without arguments whenever dp_nbr is updated"""
+        if not self._subscriptions.subscribe(cb, dp_id=dp_nbr, pass_update=False):
+            Ism8.log.error(f"datapoint {dp_nbr} not supported by ISM8 firmware")
+            return False
+        return True
+
+    def remove_callback(self, dp_nbr, cb=None):
+        """removes cb (or all callbacks if cb is None) of dp_nbr"""
+        self._subscriptions.unsubscribe(cb, dp_id=dp_nbr)
+
+    def subscribe(self, cb, dp_id=None, device=None, dp_type=None) -> bool:
+        """
+        cb is called with the DatapointUpdate for a datapoint, all datapoints
+        of a device, all datapoints of a datatype or, without any of them,
+        for all datapoints. Returns False if the firmware lacks the datapoint
+        """
+        if not self._subscriptions.subscribe(cb, dp_id, device, dp_type):
+            Ism8.log.error(f"datapoint {dp_id} not supported by ISM8 firmware")
+            return False
+        return True
+
+    def unsubscribe(self, cb, dp_id=None, device=None, dp_type=None):
+        self._subscriptions.unsubscribe(cb, dp_id, device, dp_type)
+
+    def register_batch_callback(self, cb):
+        """cb is called once per message with the list of DatapointUpdates"""
+        self._callback_on_batch.append(cb)
 
-    def remove_callback(self, dp_nbr):
-        self._callback_on_data.pop(dp_nbr)
+    def remove_batch_callback(self, cb):
+        self._callback_on_batch.remove(cb)
+
+    def set_notification_filter(self, notification_filter) -> None:
+        """
+        sets a NotificationFilter. Values are always stored, but callbacks only
+        fire for values which pass the filter. None disables filtering
+        """
+        if self._notification_filter is not None:
+            self._notification_filter.set_trailing_callback(None)
+            self._notification_filter.reset()
+        self._notification_filter = notification_filter
+        if notification_filter is not None:
+            notification_filter.set_trailing_callback(self._notify_trailing)
+
+    def _notify_trailing(self, dp_id: int, value) -> None:
+        """dispatches a change which the notification filter delayed"""
+        self._dispatch_updates([DatapointUpdate(dp_id, value)])
 
     def connected(self):
         return self._connected
 
     def data_received(self, data) -> None:
         """is called whenever data is ready. Conducts buffering, slices the messages
-        and extracts the payload for further processing. Returns false if ISM8 data
-        could not be processed"""
-        frame_size = 0
+        and extracts the payload for further processing. Incomplete frames are kept
+        in the receive buffer until the rest arrives with the next TCP segment.
+        Returns false if no ISM8 data could be found"""
+        # logging is checked once per call, messages are only built if needed
+        debug = Ism8.log.isEnabledFor(logging.DEBUG)
+        if self._capture is not None:
+            self._capture.write(DIRECTION_RX, self._remote_ip_address, data)
+        buf = self._rx_buffer
+        buf.extend(data)
         # find first header location
-        ptr = data.find(ISM_HEADER)
+        ptr = buf.find(ISM_HEADER)
         if ptr == -1:
             Ism8.log.error("No ISM8-signature in network message. Skipping data.")
+            self._metrics.drop(DROP_NO_HEADER)
+            # keep the tail, it might be the beginning of a split header
+            del buf[: max(0, len(buf) - len(ISM_HEADER) + 1)]
             return False
+        if ptr > 0:
+            Ism8.log.info("skipping %s bytes in front of ISM8-signature", ptr)
         # loop from header to header (if there are more than 1)
-        # loop ends when no header is found in the remaining data
-        while ptr >= 0:
-            Ism8.log.debug(f"found header at {ptr}")
-            # smallest processable data: KNX header (6 bytes) and conn. header (4bytes)
-            if len(data[ptr:]) >= 10:
-                # frame size is encoded at offset +4 (2bytes)
-                frame_size = 256 * data[ptr + 4] + data[ptr + 5]
-                Ism8.log.debug(f"msg length = {frame_size}")
-            else:
-                Ism8.log.error("Broken header structure. Skipping data.")
-                return False
+        # loop ends when no header is found in the remaining data or the
+        # remaining frame is incomplete
+        profiler = self._profiler
+        try:
+            with memoryview(buf) as view:
+                while ptr >= 0:
+                    if profiler is not None:
+                        frame_start = time.perf_counter()
+                    # smallest processable data:
+                    # KNX header (6 bytes) and conn. header (4bytes)
+                    if len(buf) - ptr < 10:
+                        if debug:
+                            Ism8.log.debug("incomplete header, waiting for more data.")
+                        break
+                    # frame size is encoded at offset +4 (2bytes)
+                    frame_size = 256 * buf[ptr + 4] + buf[ptr + 5]
+                    if debug:
+                        Ism8.log.debug("found header at %s, length %s", ptr, frame_size)
+                    if frame_size < 10:
+                        Ism8.log.error("Broken header structure. Skipping header.")
+                        self._metrics.drop(DROP_BROKEN_HEADER)
+                        ptr = buf.find(ISM_HEADER, ptr + 1)
+                        continue
+                    if len(buf) - ptr < frame_size:
+                        if debug:
+                            Ism8.log.debug(
+                                "Object server message incomplete (%s bytes), waiting.",
+                                len(buf) - ptr,
+                            )
+                        break
+
+                    self._metrics.frames_received += 1
+                    if self._trace is not None:
+                        self._trace.append(
+                            (
+                                time.monotonic(),
+                                "rx",
+                                bytes(view[ptr : ptr + frame_size]),
+                            )
+                        )
+                    # process next ObjectServer message (see docs),
+                    # starts at ISM-header+10
+                    msg = view[ptr + 10 : ptr + frame_size]
+                    frame = None
+                    try:
+                        if self._supervisor is not None:
+                            self._supervisor.frame_received(time.monotonic())
+                        if profiler is not None and profiler.sample():
+                            frame = view[ptr : ptr + frame_size]
+                            processed = self._process_profiled(frame, msg, frame_start)
+                        else:
+                            processed = self.process_object_server_msg(msg)
+                    except BaseException:
+                        # a callback raised: drop this frame, keep the following ones
+                        ptr += frame_size
+                        raise
+                    finally:
+                        msg.release()
+                        if frame is not None:
+                            frame.release()
+                    if processed:
+                        # answers to 'get datapoint value' are not acknowledged
+                        if buf[ptr + 10 : ptr + 12] != ISM_SERVICE_GET_VALUE_RES:
+                            if debug:
+                                Ism8.log.debug(
+                                    "Message successfully processed, sending ACK"
+                                )
+                            # send ACK to ISM8 according to API: ISM Header, then
+                            # msg-length(17), then ACK w/ 2 bytes from original msg
+                            ack_msg = bytearray(ISM_ACK_DP_MSG)
+                            ack_msg[12] = buf[ptr + 12]
+                            ack_msg[13] = buf[ptr + 13]
+                            self._write(ack_msg)
+                            self._metrics.frames_acked += 1
+                    else:
+                        Ism8.log.info("Message faulty, maybe resend by ISM8. No ACK.")
+                    if self._rx_reset:
+                        # connection ended in a callback, drop the remaining data
+                        break
+
+                    # advance ptr to next msg, resync on the next header if there
+                    # is garbage between the frames
+                    ptr = ptr + frame_size
+                    if ptr == len(buf):
+                        break
+                    next_ptr = buf.find(ISM_HEADER, ptr)
+                    if next_ptr == -1:
+                        Ism8.log.error("No ISM8-signature in remaining data. Skipping.")
+                        self._metrics.drop(DROP_NO_HEADER)
+                        ptr = max(ptr, len(buf) - len(ISM_HEADER) + 1)
+                        break
+                    if next_ptr > ptr:
+                        Ism8.log.info("skipping %s bytes of garbage", next_ptr - ptr)
+                    ptr = next_ptr
+        finally:
+            self._trim_rx_buffer(ptr)
+        return True
 
-            if len(data[ptr:]) < frame_size:
-                Ism8.log.debug(f"data length = {len(data)}")
-                Ism8.log.error("Object server message too short. Skipping data.")
-                return False
+    def _trim_rx_buffer(self, ptr: int) -> None:
+        """drops everything in front of ptr, keeps incomplete frames"""
+        buf = self._rx_buffer
+        if self._rx_reset:
+            # connection ended in a callback, drop the remaining data
+            self._rx_reset = False
+            buf.clear()
+            return
+        if ptr == -1:
+            ptr = max(0, len(buf) - len(ISM_HEADER) + 1)
+        del buf[:ptr]
+
+    def _clear_rx_buffer(self) -> None:
+        try:
+            self._rx_buffer.clear()
+        except BufferError:
+            # data_received holds views on the buffer, it clears it afterwards
+            self._rx_reset = True
+
+    def _write(self, msg) -> None:
+        """sends a message to ISM8, if connected"""
+        if self._transport:
+            if self._trace is not None:
+                self._trace.append((time.monotonic(), "tx", bytes(msg)))
+            if self._capture is not None:
+                self._capture.write(DIRECTION_TX, self._remote_ip_address, msg)
+            self._transport.write(msg)
+
+    def enable_supervision(
+        self,
+        silence_timeout: float = ISM_SILENCE_TIMEOUT,
+        resync_interval: float = ISM_RESYNC_INTERVAL,
+    ) -> ConnectionSupervisor:
+        """
+        supervises the link to ISM8: values are marked stale after
+        silence_timeout seconds without a frame, and after (re)connecting they
+        are marked unknown. Both trigger refresh_stale, at most once per
+        resync_interval seconds
+        """
+        self.disable_supervision()
+        self._supervisor = ConnectionSupervisor(
+            self.refresh_stale,
+            self._set_quality,
+            silence_timeout,
+            resync_interval,
+        )
+        if self._connected:
+            self._supervisor.connection_made()
+        return self._supervisor
+
+    def disable_supervision(self) -> None:
+        if self._supervisor is not None:
+            self._supervisor.stop()
+            self._supervisor = None
+
+    def _set_quality(self, quality: int) -> None:
+        # the store is replaced when the firmware version is set
+        self._dp_values.set_quality(quality)
+
+    def enable_capture(self, capture_writer) -> None:
+        """
+        records all received and sent network data with a CaptureWriter.
+        The captured data can be replayed with replay_capture
+        """
+        self._capture = capture_writer
 
-            # process next ObjectServer message (see docs), starts at ISM-header+10
-            msg = data[ptr + 10 : ptr + frame_size]
-            if self.process_object_server_msg(msg):
-                Ism8.log.debug("Message successfully processed, sending ACK")
-                # send ACK to ISM8 according to API: ISM Header,
-                # then msg-length(17), then ACK w/ 2 bytes from original msg
-                ack_msg = bytearray(ISM_ACK_DP_MSG)
-                ack_msg[12] = data[ptr + 12]
-                ack_msg[13] = data[ptr + 13]
-                if self._transport:
-                    self._transport.write(ack_msg)
-            else:
-                Ism8.log.info("Message faulty, maybe resend by ISM8. No ACK.")
-
-            # prepare to get decode message; advance Ptr to next Msg if bytes are left
-            ptr = ptr + frame_size
-            if len(data[ptr:]) > 0:
-                Ism8.log.info("more data in buffer. Try to extract next datagram.")
-                ptr = data.find(ISM_HEADER)
-            else:
-                Ism8.log.info("End of network buffer.")
-                break
-        return True
+    def disable_capture(self) -> None:
+        self._capture = None
+
+    def enable_trace(self, depth: int = 100) -> None:
+        """
+        records the last <depth> raw frames (received and sent) in a ring
+        buffer. Frames are only rendered when get_trace is called
+        """
+        self._trace = collections.deque(maxlen=depth)
+
+    def disable_trace(self) -> None:
+        self._trace = None
+
+    def get_trace(self) -> list:
+        """returns the recorded frames as list of printable lines"""
+        if self._trace is None:
+            return []
+        return [
+            f"{timestamp:.6f} {direction} {frame.hex(':')}"
+            for timestamp, direction, frame in self._trace
+        ]
 
     def process_object_server_msg(self, msg: bytes):
         """
         Processes received datagram(s) according to ISM8 API specification.
-        Split into dp_id, message length and encoded values for further processing
-        """
-        Ism8.log.debug(f"ObjectServer message received: {msg.hex(':')}")
-        # number of datapoints in message are coded into bytes 4 and 5
-        number_of_datapoints = msg[4] * 256 + msg[5]
-        # data_ptr keeps track of the bytes
-        data_ptr = 0
-        counter = 1
-        while counter <= number_of_datapoints:
-            Ism8.log.debug(f"processing datapoint {counter} / {number_of_datapoints}")
-            dp_id = msg[data_ptr + 6] * 256 + msg[data_ptr + 7]
-            dp_length = msg[data_ptr + 9]
-            if dp_length > 0:
-                dp_value = msg[data_ptr + 10 : data_ptr + 10 + dp_length]
-                Ism8.log.debug(f"DP {dp_id}, raw value: {dp_value.hex(':')}")
-                self.decode_datapoint(dp_id, dp_value)
-            else:
-                Ism8.log.info(f"DP {dp_id} discarded due to zero data")
-                return False
-            # now advance counters, go on to next datapoint in message (if any)
-            counter += 1
-            data_ptr = data_ptr + 4 + dp_length
+        All datapoints of the message are decoded first and then applied
+        as one batch. Decoding and callbacks of sampled messages are timed
+        for the metrics
+        """
+        timed = self._metrics.sample()
+        updates = decode_frame(msg, self._active_dps, self._metrics, timed)
+        if updates is None:
+            return False
+        self.apply_updates(updates, timed)
         return True
 
+    def _process_profiled(self, frame, msg, frame_start: float) -> bool:
+        """same as process_object_server_msg, records the time of each stage"""
+        start = time.perf_counter()
+        stages = {STAGE_FRAMING: start - frame_start}
+        timed = self._metrics.sample()
+        updates = decode_frame(msg, self._active_dps, self._metrics, timed)
+        decoded = time.perf_counter()
+        stages[STAGE_DECODE] = decoded - start
+        if updates is not None:
+            updates = self._store_updates(updates)
+            stored = time.perf_counter()
+            stages[STAGE_STORE] = stored - decoded
+            self._dispatch_updates(updates, timed)
+            stages[STAGE_CALLBACKS] = time.perf_counter() - stored
+        self._profiler.record(frame, stages)
+        return updates is not None
+
+    def enable_profiler(self, slowest: int = 10, sample_interval: int = 1):
+        """
+        times the processing stages (framing, decode, store, callbacks) of one
+        of sample_interval received frames and keeps the <slowest> frames with
+        raw bytes. Timing hooks can be added to the returned FrameProfiler
+        """
+        self._profiler = FrameProfiler(slowest, sample_interval)
+        return self._profiler
+
+    def disable_profiler(self) -> None:
+        self._profiler = None
+
+    def get_profile(self) -> list:
+        """returns FrameProfiles of the slowest frames, slowest first"""
+        if self._profiler is None:
+            return []
+        return self._profiler.get_slowest()
+
     def decode_datapoint(self, dp_id: int, raw_bytes: bytes) -> None:
         """
         receives raw bytes, decodes them according to ISM8-API data type
         into int/str/float values and stores them in dictionary
         """
-        if dp_id in DATAPOINTS:
-            dp_type = DATAPOINTS[dp_id][IX_TYPE]
-        else:
-            Ism8.log.info(f"unknown datapoint: {dp_id}, data:{raw_bytes.hex(':')}")
+        if self._active_dps is not None and dp_id not in self._active_dps:
             return
+        value = decode_value(dp_id, raw_bytes)
+        if value is not None:
+            self.apply_updates([DatapointUpdate(dp_id, value)])
+        return
 
-        result = 0
-        for single_byte in raw_bytes:
-            result = result * 256 + int(single_byte)
-
-        if dp_type in (
-            "DPT_Switch",
-            "DPT_Bool",
-            "DPT_Enable",
-            "DPT_OpenClose",
-        ):
-            self._dp_values[dp_id] = decode_Bool(result)
-
-        elif dp_type in (
-            "DPT_Value_Temp",
-            "DPT_Value_Tempd",
-            "DPT_Tempd",
-            "DPT_Value_Pres",
-            "DPT_Power",
-            "DPT_Value_Volume_Flow",
-        ):
-            temp_value = decode_Float(result)
-            if temp_value is None or (temp_value > 1000 and dp_type == "DPT_Power"):
-                # ignore invalid data, not clear where it comes from...
-                Ism8.log.debug("discarding %s, out of range", temp_value)
-                return
-            else:
-                self._dp_values[dp_id] = temp_value
-
-        elif dp_type in ("DPT_ActiveEnergy", "DPT_ActiveEnergy_kWh"):
-            self._dp_values[dp_id] = decode_Int(result)
-
-        elif dp_type == "DPT_FlowRate_m3/h":
-            temp_value = 0.0001 * decode_Int(result)
-            # ignore wrong data , not clear where it comes from...
-            if temp_value > 1000:
-                Ism8.log.debug("discarding %s, out of range", temp_value)
-                return
-            else:
-                self._dp_values[dp_id] = temp_value
-
-        elif dp_type == "DPT_Scaling":
-            self._dp_values[dp_id] = decode_Scaling(result)
-
-        elif dp_type == "DPT_HVACMode":
-            self._dp_values[dp_id] = decode_dict(result, HVACModes)
-
-        elif dp_type == "DPT_HVACMode_CWL":
-            self._dp_values[dp_id] = decode_dict(result, HVACModes_CWL)
-
-        elif dp_type == "DPT_DHWMode":
-            self._dp_values[dp_id] = decode_dict(result, DHWModes)
-
-        elif dp_type == "DPT_HVACContrMode":
-            self._dp_values[dp_id] = decode_dict(result, HVACContrModes)
-
-        elif dp_type == "DPT_Date":
-            self._dp_values[dp_id] = decode_date(result)
-
-        elif dp_type == "DPT_TimeOfDay":
-            self._dp_values[dp_id] = decode_time_of_day(result)
+    def apply_updates(self, updates: list, timed: bool = False) -> None:
+        """
+        stores decoded datapoint updates in dictionary, then calls the
+        callbacks of the single datapoints and the batch callbacks. With
+        timed, the latency of callbacks called inline is observed
+        """
+        self._dispatch_updates(self._store_updates(updates), timed)
+
+    def _store_updates(self, updates: list) -> list:
+        """stores updates, returns the updates which pass the notification filter"""
+        now = time.monotonic()
+        store_value = self._dp_values.set
+        for dp_id, value in updates:
+            store_value(dp_id, value, now)
+        if self._history is not None:
+            self._history.add(updates, now)
+        if self._pending_writes:
+            self._confirm_writes(updates)
+        if self._notification_filter is not None:
+            should_notify = self._notification_filter.should_notify
+            updates = [u for u in updates if should_notify(u.dp_id, u.value, now)]
+        return updates
+
+    def _dispatch_updates(self, updates: list, timed: bool = False) -> None:
+        """calls (or queues) the callbacks of the updates"""
+        get_listeners = self._subscriptions.get_listeners
+        queue = self._dispatch_queue
+        for update in updates:
+            for cb, pass_update in get_listeners(update.dp_id):
+                args = (update,) if pass_update else ()
+                if queue is not None:
+                    queue.put(cb, args, update.dp_id)
+                elif timed:
+                    self._run_timed(cb, *args)
+                else:
+                    run_callback(cb, *args)
+        if updates:
+            for cb in self._callback_on_batch:
+                if queue is None:
+                    if timed:
+                        self._run_timed(cb, updates)
+                    else:
+                        run_callback(cb, updates)
+                else:
+                    queue.put(cb, (updates,))
+        return
 
-        else:
-            Ism8.log.info(f"datatype <{dp_type}> not implemented, fallback to INT.")
-            self._dp_values[dp_id] = decode_Int(result)
+    def _run_timed(self, cb, *args) -> None:
+        start = time.perf_counter()
+        run_callback(cb, *args)
+        self._metrics.callback_latency.observe(time.perf_counter() - start)
 
-        if self._dp_values[dp_id] is not None:
-            Ism8.log.debug(f"decoded {result} to {self._dp_values[dp_id]}")
-        else:
-            Ism8.log.error(f"error dp {dp_id}, msg: {raw_bytes}, type {dp_type}")
+    def get_metrics(self) -> dict:
+        """
+        returns counters (frames received and acknowledged, drops by reason)
+        and histograms (decode time per datatype, callback latency, write
+        round trip time) as dictionary
+        """
+        return self._metrics.as_dict()
 
-        if dp_id in self._callback_on_data.keys():
-            Ism8.log.debug(f"calling callback for dp_id {dp_id}.")
-            self._callback_on_data[dp_id]()
-        else:
-            Ism8.log.debug(f"no callback for dp_id {dp_id}.")
-        return
+    def get_metrics_text(self, prefix: str = "wolf_ism8") -> str:
+        """
+        returns the metrics in Prometheus text exposition format, labeled with
+        the gateway address. See serve_metrics for an HTTP endpoint
+        """
+        labels = {}
+        if self._remote_ip_address is not None:
+            labels["gateway"] = self._remote_ip_address
+        return self._metrics.exposition(prefix, labels)
+
+    def enable_dispatch_queue(
+        self, maxsize: int = 1000, overflow: str = DISPATCH_DROP_OLDEST
+    ) -> DispatchQueue:
+        """
+        callbacks are no longer called inline, but queued and called by a
+        worker task. overflow is one of DISPATCH_DROP_OLDEST, DISPATCH_COALESCE
+        and DISPATCH_BACKPRESSURE
+        """
+        if self._dispatch_queue is not None:
+            self._dispatch_queue.stop()
+        self._dispatch_queue = DispatchQueue(maxsize, overflow)
+        self._dispatch_queue.set_flow_control(self._pause_reading, self._resume_reading)
+        return self._dispatch_queue
+
+    def disable_dispatch_queue(self) -> None:
+        if self._dispatch_queue is not None:
+            self._dispatch_queue.stop()
+            self._dispatch_queue = None
+
+    def enable_write_queue(
+        self,
+        window: float = ISM_WRITE_WINDOW,
+        min_interval: float = ISM_WRITE_MIN_INTERVAL,
+        maxsize: int = ISM_MAX_QUEUED_WRITES,
+    ) -> WriteQueue:
+        """
+        writes of send_dp_value are no longer sent immediately, but queued
+        for window seconds. Within the window, only the last value of a
+        datapoint is sent. Frames are sent at most once per min_interval
+        """
+        if self._write_queue is not None:
+            self._write_queue.stop()
+        self._write_queue = WriteQueue(
+            self._pack_frames, self._write, window, min_interval, maxsize
+        )
+        return self._write_queue
+
+    def disable_write_queue(self) -> None:
+        if self._write_queue is not None:
+            self._write_queue.stop()
+            self._write_queue = None
+
+    def _pause_reading(self) -> None:
+        if self._transport is not None:
+            self._transport.pause_reading()
+
+    def _resume_reading(self) -> None:
+        if self._transport is not None:
+            self._transport.resume_reading()
 
     def send_dp_value(self, dp_id: int, value) -> None:
         """
@@ -320,90 +747,237 @@ class Ism8(asyncio.Protocol):
         # now encode the value according to ISM8 spec, depending on data-type
         # if encoding fails, None is returned an no data is sent
         encoded_value = self.encode_datapoint(value, dp_id)
+        if encoded_value is None:
+            return False
 
-        if encoded_value is not None:
+        if self._write_queue is not None:
+            Ism8.log.debug(f"queueing datapoint number {dp_id} as {encoded_value}")
+            if not self._write_queue.put(dp_id, encoded_value):
+                return False
+        else:
             # prepare frame with obj info
             update_msg = self.build_message(dp_id, encoded_value)
             Ism8.log.debug(f"sending datapoint number {dp_id} as {encoded_value}")
             Ism8.log.debug(f"update msg = {update_msg}")
             # now send message to ISM8
-            self._transport.write(update_msg)  # type: ignore
-            # after sending update internal cache
-            Ism8.log.debug(f"updating cache for {dp_id} with {value}")
-            self._dp_values[dp_id] = value
+            self._write(update_msg)
+        # after sending update internal cache
+        Ism8.log.debug(f"updating cache for {dp_id} with {value}")
+        self._dp_values[dp_id] = value
         return True
 
+    async def async_send_dp_value(
+        self,
+        dp_id: int,
+        value,
+        timeout: float = ISM_WRITE_TIMEOUT,
+        retries: int = ISM_WRITE_RETRIES,
+    ) -> bool:
+        """
+        sends value for a (writable) datapoint in ISM8 and waits until ISM8
+        reports the new value back. The write is repeated if ISM8 does not
+        answer within timeout. The internal cache is only updated by the
+        confirmation. Returns True if the write has been confirmed
+        """
+        if not validate_dp_range(dp_id, value):
+            Ism8.log.error("data validation failed. data may be out of range.")
+            return False
+        if not self._connected or self._transport is None:
+            Ism8.log.error("No Connection to ISM8 Module")
+            return False
+        encoded_value = self.encode_datapoint(value, dp_id)
+        if encoded_value is None:
+            return False
+
+        if dp_id in self._pending_writes:
+            # a newer write supersedes the pending one
+            _, old_future = self._pending_writes.pop(dp_id)
+            if not old_future.done():
+                old_future.set_result(False)
+        elif len(self._pending_writes) >= ISM_MAX_PENDING_WRITES:
+            Ism8.log.error("too many writes waiting for confirmation by ISM8")
+            return False
+
+        if self._write_queue is not None:
+            self._write_queue.discard(dp_id)
+        # ISM8 reports the value back as it decodes from the sent bytes
+        expected = decode_value(dp_id, encoded_value)
+        future = asyncio.get_running_loop().create_future()
+        self._pending_writes[dp_id] = (expected, future)
+        update_msg = self.build_message(dp_id, encoded_value)
+        try:
+            for attempt in range(retries + 1):
+                if self._transport is None or not self._connected:
+                    break
+                Ism8.log.debug(f"sending datapoint {dp_id}, attempt {attempt + 1}")
+                self._write(update_msg)
+                sent = time.monotonic()
+                try:
+                    confirmed = await asyncio.wait_for(asyncio.shield(future), timeout)
+                    if confirmed:
+                        self._metrics.write_rtt.observe(time.monotonic() - sent)
+                    return confirmed
+                except asyncio.TimeoutError:
+                    Ism8.log.info(f"no confirmation from ISM8 for datapoint {dp_id}")
+            Ism8.log.error(f"write of datapoint {dp_id} not confirmed by ISM8")
+            return False
+        finally:
+            if self._pending_writes.get(dp_id, (None, None))[1] is future:
+                self._pending_writes.pop(dp_id)
+
+    def _confirm_writes(self, updates: list) -> None:
+        """resolves pending writes whose value has been reported back by ISM8"""
+        for dp_id, value in updates:
+            if dp_id in self._pending_writes:
+                expected, future = self._pending_writes[dp_id]
+                if value == expected and not future.done():
+                    Ism8.log.debug(f"write of datapoint {dp_id} confirmed")
+                    future.set_result(True)
+
+    def send_many(self, values: dict) -> tuple:
+        """
+        sends values for several (writable) datapoints in ISM8, packed into as
+        few messages as possible. Returns a tuple of two lists: the datapoints
+        which have been transmitted and the datapoints which failed
+        """
+        encoded_values = []
+        failed = []
+        for dp_id, value in values.items():
+            if dp_id not in DATAPOINTS:
+                Ism8.log.error(f"unknown datapoint: {dp_id}, data: {value}")
+                failed.append(dp_id)
+                continue
+            if not validate_dp_range(dp_id, value):
+                Ism8.log.error(f"data validation failed for datapoint {dp_id}.")
+                failed.append(dp_id)
+                continue
+            encoded_value = self.encode_datapoint(value, dp_id)
+            if encoded_value is None:
+                failed.append(dp_id)
+                continue
+            encoded_values.append((dp_id, encoded_value))
+
+        if not self._connected or self._transport is None:
+            Ism8.log.error("No Connection to ISM8 Module")
+            return [], failed + [dp_id for dp_id, _ in encoded_values]
+
+        # pack datapoints into frames, sorted by id, each frame limited in size
+        encoded_values.sort(key=lambda item: item[0])
+        for update_msg in self._pack_frames(encoded_values):
+            self._write(update_msg)
+
+        transmitted = [dp_id for dp_id, _ in encoded_values]
+        if self._write_queue is not None:
+            for dp_id in transmitted:
+                self._write_queue.discard(dp_id)
+        Ism8.log.debug(f"sent datapoints {transmitted}, failed {failed}")
+        for dp_id in transmitted:
+            self._dp_values[dp_id] = values[dp_id]
+        return transmitted, failed
+
+    def _pack_frames(self, encoded_values: list) -> list:
+        """
+        packs (dp_id, encoded_value) tuples into as few messages as possible,
+        each message limited in size
+        """
+        messages = []
+        frame = []
+        frame_size = ISM_MSG_OVERHEAD
+        for dp_id, encoded_value in encoded_values:
+            dp_size = 4 + len(encoded_value)
+            if frame and frame_size + dp_size > ISM_MAX_FRAME_SIZE:
+                messages.append(self.build_multi_message(frame))
+                frame = []
+                frame_size = ISM_MSG_OVERHEAD
+            frame.append((dp_id, encoded_value))
+            frame_size += dp_size
+        if frame:
+            messages.append(self.build_multi_message(frame))
+        return messages
+
     def build_message(self, dp_id: int, encoded_value: bytearray):
+        return self.build_multi_message([(dp_id, encoded_value)])
+
+    def build_multi_message(self, encoded_values: list) -> bytearray:
+        """
+        builds one message for a list of (dp_id, encoded_value) tuples.
+        The first datapoint id is used as start datapoint
+        """
         update_msg = bytearray()
         update_msg.extend(ISM_HEADER)
         update_msg.extend((0).to_bytes(2, byteorder="big"))
         update_msg.extend(ISM_CONN_HEADER)
         update_msg.extend(ISM_SERVICE_TRANSMIT)
-        update_msg.extend(dp_id.to_bytes(2, byteorder="big"))
-        update_msg.extend((1).to_bytes(2, byteorder="big"))
-
-        update_msg.extend(dp_id.to_bytes(2, byteorder="big"))
-        update_msg.extend((0).to_bytes(1, byteorder="big"))
-        update_msg.extend((len(encoded_value)).to_bytes(1, byteorder="big"))
-        update_msg.extend(encoded_value)
+        update_msg.extend(encoded_values[0][0].to_bytes(2, byteorder="big"))
+        update_msg.extend((len(encoded_values)).to_bytes(2, byteorder="big"))
+
+        for dp_id, encoded_value in encoded_values:
+            update_msg.extend(dp_id.to_bytes(2, byteorder="big"))
+            update_msg.extend((0).to_bytes(1, byteorder="big"))
+            update_msg.extend((len(encoded_value)).to_bytes(1, byteorder="big"))
+            update_msg.extend(encoded_value)
         frame_size = len(update_msg).to_bytes(2, byteorder="big")
         update_msg[4] = frame_size[0]
         update_msg[5] = frame_size[1]
         return update_msg
 
+    def build_read_message(self, start: int, count: int) -> bytearray:
+        """builds a 'get datapoint value' request for count datapoints from start"""
+        read_msg = bytearray()
+        read_msg.extend(ISM_HEADER)
+        read_msg.extend((16).to_bytes(2, byteorder="big"))
+        read_msg.extend(ISM_CONN_HEADER)
+        read_msg.extend(ISM_SERVICE_GET_VALUE)
+        read_msg.extend(start.to_bytes(2, byteorder="big"))
+        read_msg.extend(count.to_bytes(2, byteorder="big"))
+        return read_msg
+
     def encode_datapoint(self, value, dp_id):
         # check if DP exists
-        if dp_id in DATAPOINTS:
-            dp_type = DATAPOINTS[dp_id][IX_TYPE]
-        else:
+        if dp_id not in DP_ENCODERS:
             Ism8.log.error(f"unknown datapoint: {dp_id}, data: {value}")
             return None
+        if self._active_dps is not None and dp_id not in self._active_dps:
+            Ism8.log.error(f"datapoint {dp_id} not supported by ISM8 firmware")
+            return None
+        encoder = DP_ENCODERS[dp_id]
+        if encoder is None:
+            Ism8.log.info(f"writing datatype not implemented: {Ism8.get_type(dp_id)}")
+            return None
+        return encoder(value)
 
-        if dp_type in (
-            "DPT_Switch",
-            "DPT_Bool",
-            "DPT_Enable",
-            "DPT_OpenClose",
-        ):
-            return encode_Bool(value)
-
-        elif dp_type in (
-            "DPT_Value_Temp",
-            "DPT_Value_Tempd",
-            "DPT_Tempd",
-            "DPT_Value_Pres",
-            "DPT_Power",
-            "DPT_Value_Volume_Flow",
-        ):
-            return encode_Float(value)
-
-        elif dp_type == "DPT_Scaling":
-            return encode_Scaling(value)
-
-        elif dp_type == "DPT_HVACMode":
-            return encode_dict(value, HVACModes)
-
-        elif dp_type == "DPT_HVACMode_CWL":
-            return encode_dict(value, HVACModes_CWL)
-
-        elif dp_type == "DPT_HVACContrMode":
-            return encode_dict(value, HVACContrModes)
+    def read_sensor(self, dp_id: int):
+        """
+        Returns sensor value from private dictionary of sensor-readings
+        """
+        return self._dp_values.get(dp_id, None)
 
-        elif dp_type == "DPT_DHWMode":
-            return encode_dict(value, DHWModes)
+    def read_sensor_with_age(self, dp_id: int) -> tuple:
+        """
+        Returns sensor value and seconds since its last update,
+        (None, None) if no value has been received
+        """
+        return self._dp_values.get_with_age(dp_id)
 
-        elif dp_type == "DPT_Date":
-            return encode_date(value)
+    def enable_history(self, depth: int = 1000, dp_ids=None) -> None:
+        """
+        keeps the last <depth> values of all (or the given) numeric
+        datapoints with their monotonic timestamps
+        """
+        self._history = HistoryBuffer(depth, dp_ids)
 
-        elif dp_type == "DPT_TimeOfDay":
-            return encode_time_of_day(value)
+    def disable_history(self) -> None:
+        self._history = None
 
-        else:
-            Ism8.log.info(f"writing datatype not implemented: {dp_type}")
+    def get_history(self, dp_id: int) -> DatapointHistory | None:
+        """Returns the value history of a datapoint, None if there is none"""
+        if self._history is None:
             return None
+        return self._history.get(dp_id)
 
-    def read_sensor(self, dp_id: int):
+    def get_snapshot(self, dp_ids=None) -> list:
         """
-        Returns sensor value from private dictionary of sensor-readings
+        Returns DatapointStates (dp_id, value, monotonic timestamp, quality)
+        of all (or the given) datapoints with a value
         """
-        return self._dp_values.get(dp_id, None)
+        return self._dp_values.snapshot(dp_ids)
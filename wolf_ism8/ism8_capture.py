@@ -0,0 +1,124 @@
+"""
+Append-only capture of ISM8 network traffic and replay into an Ism8 instance
+"""
+
+import asyncio
+import mmap
+import os
+import struct
+import time
+from typing import NamedTuple
+
+CAPTURE_MAGIC = b"ISM8CAP\x01"
+# record header: monotonic timestamp, direction, length of peer, length of data
+_RECORD = struct.Struct("<dBBI")
+
+DIRECTION_RX = 0
+DIRECTION_TX = 1
+
+
+class CaptureRecord(NamedTuple):
+    """one captured network chunk. data is only valid until the next record"""
+
+    timestamp: float
+    direction: int
+    peer: str
+    data: memoryview
+
+
+class CaptureWriter:
+    """appends network chunks to a capture file"""
+
+    def __init__(self, path):
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+        return
+
+    def write(self, direction: int, peer: str, data, timestamp=None) -> None:
+        if timestamp is None:
+            timestamp = time.monotonic()
+        peer_bytes = (peer or "").encode()
+        self._file.write(_RECORD.pack(timestamp, direction, len(peer_bytes), len(data)))
+        self._file.write(peer_bytes)
+        self._file.write(data)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_capture(path):
+    """
+    yields CaptureRecords of a capture file. The file is memory mapped,
+    so captures larger than RAM can be read
+    """
+    if os.path.getsize(path) <= len(CAPTURE_MAGIC):
+        return
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        if mapped[: len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not an ISM8 capture")
+        with memoryview(mapped) as view:
+            ptr = len(CAPTURE_MAGIC)
+            while ptr + _RECORD.size <= len(mapped):
+                timestamp, direction, peer_len, data_len = _RECORD.unpack_from(
+                    mapped, ptr
+                )
+                ptr += _RECORD.size
+                peer = bytes(view[ptr : ptr + peer_len]).decode()
+                ptr += peer_len
+                if ptr + data_len > len(mapped):
+                    # truncated last record, e.g. capture still being written
+                    break
+                data = view[ptr : ptr + data_len]
+                ptr += data_len
+                try:
+                    yield CaptureRecord(timestamp, direction, peer, data)
+                finally:
+                    data.release()
+
+
+def replay_capture(path, ism8, peer=None) -> int:
+    """
+    feeds all received chunks of a capture (optionally of one peer) into
+    ism8.data_received as fast as possible. Returns the number of chunks
+    """
+    count = 0
+    for record in read_capture(path):
+        if record.direction == DIRECTION_RX and (peer is None or record.peer == peer):
+            ism8.data_received(record.data)
+            count += 1
+    return count
+
+
+async def async_replay_capture(path, ism8, peer=None, speed: float = 1.0) -> int:
+    """
+    feeds received chunks of a capture into ism8.data_received with the
+    recorded timing, divided by speed. Returns the number of chunks
+    """
+    count = 0
+    start = None
+    loop = asyncio.get_running_loop()
+    for record in read_capture(path):
+        if record.direction != DIRECTION_RX:
+            continue
+        if peer is not None and record.peer != peer:
+            continue
+        if start is None:
+            start = (record.timestamp, loop.time())
+        delay = start[1] + (record.timestamp - start[0]) / speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        ism8.data_received(record.data)
+        count += 1
+    return count
@@ -0,0 +1,363 @@
+"""
+Registry of decoders and encoders for the datapoint types (DPT) of the ISM8 API
+"""
+
+import logging
+import time
+from functools import partial
+from typing import NamedTuple
+from .ism8_constants import *
+from .ism8_helper_functions import *
+from .ism8_metrics import *
+
+log = logging.getLogger(__name__)
+
+# DPT name -> (decoder, encoder). A decoder takes the raw value as int and
+# returns the python value (or None for invalid data), an encoder takes the
+# python value and returns a bytearray (or None if encoding fails)
+DPT_CODECS = {}
+
+# codecs resolved per datapoint id, so decoding needs only one dict lookup
+DP_DECODERS = {}
+DP_ENCODERS = {}
+
+# decoder -> function decoding a list of raw values, see decode_bulk
+BULK_DECODERS = {}
+# messages with at least this number of datapoints are decoded in bulk
+BULK_MIN_DATAPOINTS = 16
+
+_DP_IDS_BY_TYPE = {}
+for _dp_id, _dp in DATAPOINTS.items():
+    _DP_IDS_BY_TYPE.setdefault(_dp[IX_TYPE], []).append(_dp_id)
+
+
+class DatapointUpdate(NamedTuple):
+    """decoded value of a single datapoint, as received from ISM8"""
+
+    dp_id: int
+    value: object
+
+
+# datatypes for which the fallback has been logged
+_FALLBACK_LOGGED = set()
+
+
+def decode_fallback(input: int, dp_id: int | None = None) -> int:
+    """decoder for datatypes without registered codec, logs once per datatype"""
+    dp_type = DATAPOINTS[dp_id][IX_TYPE] if dp_id in DATAPOINTS else None
+    if dp_type not in _FALLBACK_LOGGED:
+        _FALLBACK_LOGGED.add(dp_type)
+        log.info(
+            "datatype <%s> of dp %s not implemented, fallback to INT.", dp_type, dp_id
+        )
+    return decode_Int(input)
+
+
+def register_bulk_decoder(decoder, bulk_decoder) -> None:
+    """
+    registers a function decoding a list of raw values at once, used instead
+    of decoder for large messages. Results must be identical to decoder
+    """
+    BULK_DECODERS[decoder] = bulk_decoder
+
+
+def register_codec(dp_type: str, decoder, encoder=None) -> None:
+    """
+    registers decoder and (optional) encoder for a datatype. Replaces existing
+    codecs and updates all datapoints of this type immediately
+    """
+    DPT_CODECS[dp_type] = (decoder, encoder)
+    for dp_id in _DP_IDS_BY_TYPE.get(dp_type, ()):
+        DP_DECODERS[dp_id] = decoder
+        DP_ENCODERS[dp_id] = encoder
+
+
+def get_codec(dp_type: str) -> tuple:
+    """returns (decoder, encoder) for a datatype, (None, None) if not registered"""
+    return DPT_CODECS.get(dp_type, (None, None))
+
+
+for _dp_type in ("DPT_Switch", "DPT_Bool", "DPT_Enable", "DPT_OpenClose"):
+    register_codec(_dp_type, decode_Bool, encode_Bool)
+
+FLOAT_TYPES = (
+    "DPT_Value_Temp",
+    "DPT_Value_Tempd",
+    "DPT_Tempd",
+    "DPT_Value_Pres",
+    "DPT_Value_Volume_Flow",
+)
+
+
+# built-in codecs of the float datatypes, with and without tables
+_FLOAT_CODECS = (
+    (decode_Float_table, encode_Float_table),
+    (decode_Float, encode_Float),
+    (decode_Power_table, encode_Float_table),
+    (decode_Power, encode_Float),
+)
+
+
+def enable_float_table(enabled: bool = True) -> None:
+    """
+    switches the 2-byte float datatypes between the precomputed tables
+    (default) and the direct calculation, which needs less memory. Codecs
+    registered with register_codec are kept
+    """
+    decoder = decode_Float_table if enabled else decode_Float
+    encoder = encode_Float_table if enabled else encode_Float
+    power_decoder = decode_Power_table if enabled else decode_Power
+    for dp_type in FLOAT_TYPES + ("DPT_Power",):
+        codec = DPT_CODECS.get(dp_type)
+        if codec is not None and codec not in _FLOAT_CODECS:
+            continue
+        if dp_type == "DPT_Power":
+            register_codec(dp_type, power_decoder, encoder)
+        else:
+            register_codec(dp_type, decoder, encoder)
+
+
+enable_float_table()
+register_bulk_decoder(decode_Float_table, decode_Float_bulk)
+register_bulk_decoder(decode_Power_table, decode_Power_bulk)
+register_bulk_decoder(decode_Int, list)
+register_codec("DPT_ActiveEnergy", decode_Int)
+register_codec("DPT_ActiveEnergy_kWh", decode_Int)
+register_codec("DPT_FlowRate_m3/h", decode_FlowRate)
+register_codec("DPT_Scaling", decode_Scaling, encode_Scaling)
+register_codec(
+    "DPT_HVACMode",
+    partial(decode_dict, mode_dic=HVACModes),
+    partial(encode_dict, mode_dic=HVACModes),
+)
+register_codec(
+    "DPT_HVACMode_CWL",
+    partial(decode_dict, mode_dic=HVACModes_CWL),
+    partial(encode_dict, mode_dic=HVACModes_CWL),
+)
+register_codec(
+    "DPT_DHWMode",
+    partial(decode_dict, mode_dic=DHWModes),
+    partial(encode_dict, mode_dic=DHWModes),
+)
+register_codec(
+    "DPT_HVACContrMode",
+    partial(decode_dict, mode_dic=HVACContrModes),
+    partial(encode_dict, mode_dic=HVACContrModes),
+)
+register_codec("DPT_Date", decode_date, encode_date)
+register_codec("DPT_TimeOfDay", decode_time_of_day, encode_time_of_day)
+
+# datatypes without codec are decoded as INT and cannot be written
+for _dp_type, _dp_ids in _DP_IDS_BY_TYPE.items():
+    if _dp_type not in DPT_CODECS:
+        for _dp_id in _dp_ids:
+            DP_DECODERS[_dp_id] = partial(decode_fallback, dp_id=_dp_id)
+            DP_ENCODERS[_dp_id] = None
+
+
+def decode_value(dp_id: int, raw_bytes: bytes):
+    """
+    decodes the raw bytes of a datapoint according to its ISM8-API data type.
+    Returns None for unknown datapoints and invalid data
+    """
+    decoder = DP_DECODERS.get(dp_id)
+    if decoder is None:
+        if log.isEnabledFor(logging.INFO):
+            log.info("unknown datapoint: %s, data:%s", dp_id, bytes(raw_bytes).hex(":"))
+        return None
+    try:
+        value = decoder(int.from_bytes(raw_bytes, byteorder="big"))
+    except ValueError:
+        value = None
+    if value is None and log.isEnabledFor(logging.DEBUG):
+        # ignore invalid data, not clear where it comes from...
+        log.debug("discarding dp %s, msg: %s", dp_id, bytes(raw_bytes).hex(":"))
+    return value
+
+
+def split_frame(msg: bytes, metrics=None) -> list | None:
+    """
+    splits an ObjectServer message (payload after ISM8- and connection header)
+    into (dp_id, raw value) tuples. Returns None if the message is faulty,
+    the reason is counted in metrics, if given
+    """
+    if len(msg) < 6:
+        log.error("Object server message too short. Skipping data.")
+        if metrics is not None:
+            metrics.drop(DROP_SHORT_FRAME)
+        return None
+    # number of datapoints in message are coded into bytes 4 and 5
+    number_of_datapoints = msg[4] * 256 + msg[5]
+    datapoints = []
+    # data_ptr keeps track of the bytes
+    data_ptr = 0
+    for _ in range(number_of_datapoints):
+        if len(msg) < data_ptr + 10:
+            log.error("Object server message too short. Skipping data.")
+            if metrics is not None:
+                metrics.drop(DROP_SHORT_FRAME)
+            return None
+        dp_id = msg[data_ptr + 6] * 256 + msg[data_ptr + 7]
+        dp_length = msg[data_ptr + 9]
+        if len(msg) < data_ptr + 10 + dp_length:
+            log.error("Object server message too short. Skipping data.")
+            if metrics is not None:
+                metrics.drop(DROP_SHORT_FRAME)
+            return None
+        if dp_length == 0:
+            log.info("DP %s discarded due to zero data", dp_id)
+            if metrics is not None:
+                metrics.drop(DROP_ZERO_LENGTH)
+            return None
+        datapoints.append((dp_id, msg[data_ptr + 10 : data_ptr + 10 + dp_length]))
+        # now advance counters, go on to next datapoint in message (if any)
+        data_ptr = data_ptr + 4 + dp_length
+    return datapoints
+
+
+def decode_frame(
+    msg: bytes, active=None, metrics=None, timed: bool = False
+) -> list[DatapointUpdate] | None:
+    """
+    Decodes an ObjectServer message (payload after ISM8- and connection header)
+    into a list of datapoint updates without touching any state. Unknown
+    datapoints and invalid values are skipped. If active is given (a set of
+    datapoint ids), all other datapoints are skipped silently. Returns None if
+    the message is faulty and must not be acknowledged. Large messages (e.g. the
+    reply to 'request all datapoints') are decoded in groups of the same decoder.
+    Skipped datapoints and faulty messages are counted in metrics, if given,
+    and with timed the decode time of each datapoint is observed.
+    """
+    # logging is checked once per message, messages are only built if needed
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("ObjectServer message received: %s", msg.hex(":"))
+    if len(msg) >= 6 and msg[4] * 256 + msg[5] >= BULK_MIN_DATAPOINTS:
+        return decode_bulk(msg, debug, active, metrics, timed)
+    datapoints = split_frame(msg, metrics)
+    if datapoints is None:
+        return None
+
+    updates = []
+    for dp_id, dp_value in datapoints:
+        if active is not None and dp_id not in active:
+            continue
+        decoder = DP_DECODERS.get(dp_id)
+        if decoder is None:
+            if log.isEnabledFor(logging.INFO):
+                log.info("unknown datapoint: %s, data:%s", dp_id, dp_value.hex(":"))
+            if metrics is not None:
+                metrics.drop(DROP_UNKNOWN_DP)
+            continue
+        if timed:
+            start = time.perf_counter()
+        value = _decode_safe(decoder, int.from_bytes(dp_value, byteorder="big"))
+        if timed:
+            metrics.observe_decode(dp_id, time.perf_counter() - start)
+        if value is not None:
+            updates.append(DatapointUpdate(dp_id, value))
+        elif metrics is not None:
+            metrics.drop(DROP_INVALID_VALUE)
+        if debug:
+            log.debug("DP %s, raw: %s -> %s", dp_id, dp_value.hex(":"), value)
+    return updates
+
+
+def decode_bulk(
+    msg: bytes, debug: bool = False, active=None, metrics=None, timed: bool = False
+) -> list[DatapointUpdate] | None:
+    """
+    same as decode_frame, optimized for large messages: raw values are
+    collected per decoder and each group is decoded in one go, with a bulk
+    decoder (see BULK_DECODERS) if available
+    """
+    data = bytes(msg)
+    size = len(data)
+    number_of_datapoints = data[4] << 8 | data[5]
+    get_decoder = DP_DECODERS.get
+    # decoder -> raw values, in order of the message
+    groups = {}
+    order = []
+    ptr = 6
+    for _ in range(number_of_datapoints):
+        if ptr + 4 > size:
+            log.error("Object server message too short. Skipping data.")
+            if metrics is not None:
+                metrics.drop(DROP_SHORT_FRAME)
+            return None
+        dp_id = data[ptr] << 8 | data[ptr + 1]
+        dp_length = data[ptr + 3]
+        value_ptr = ptr + 4
+        ptr = value_ptr + dp_length
+        if ptr > size:
+            log.error("Object server message too short. Skipping data.")
+            if metrics is not None:
+                metrics.drop(DROP_SHORT_FRAME)
+            return None
+        if dp_length == 0:
+            log.info("DP %s discarded due to zero data", dp_id)
+            if metrics is not None:
+                metrics.drop(DROP_ZERO_LENGTH)
+            return None
+        if active is not None and dp_id not in active:
+            continue
+        if dp_length == 1:
+            raw = data[value_ptr]
+        elif dp_length == 2:
+            raw = data[value_ptr] << 8 | data[value_ptr + 1]
+        else:
+            raw = int.from_bytes(data[value_ptr:ptr], byteorder="big")
+        decoder = get_decoder(dp_id)
+        if decoder is None:
+            if log.isEnabledFor(logging.INFO):
+                log.info(
+                    "unknown datapoint: %s, data:%s",
+                    dp_id,
+                    data[value_ptr:ptr].hex(":"),
+                )
+            if metrics is not None:
+                metrics.drop(DROP_UNKNOWN_DP)
+            continue
+        group = groups.get(decoder)
+        if group is None:
+            group = groups[decoder] = []
+        group.append(raw)
+        order.append((dp_id, decoder))
+
+    # decoded values are consumed per decoder in the same order
+    next_value = {}
+    # decoder -> decode time per datapoint, only if timed
+    decode_time = {}
+    for decoder, raw_values in groups.items():
+        if timed:
+            start = time.perf_counter()
+        bulk_decoder = BULK_DECODERS.get(decoder)
+        if bulk_decoder is not None:
+            decoded = bulk_decoder(raw_values)
+        else:
+            decoded = [_decode_safe(decoder, raw) for raw in raw_values]
+        if timed:
+            decode_time[decoder] = (time.perf_counter() - start) / len(raw_values)
+        next_value[decoder] = iter(decoded).__next__
+
+    updates = []
+    for dp_id, decoder in order:
+        value = next_value[decoder]()
+        if timed:
+            metrics.observe_decode(dp_id, decode_time[decoder])
+        if value is not None:
+            updates.append(DatapointUpdate(dp_id, value))
+        elif metrics is not None:
+            metrics.drop(DROP_INVALID_VALUE)
+        if debug:
+            log.debug("DP %s -> %s", dp_id, value)
+    return updates
+
+
+def _decode_safe(decoder, raw: int):
+    try:
+        return decoder(raw)
+    except ValueError:
+        # e.g. invalid date, treated like other invalid data
+        return None
@@ -7,11 +7,41 @@ ISM_SERVICE_RECEIVE = b"\xF0\x06"
 ISM_SERVICE_ACK = b"\xF0\x86"
 ISM_SERVICE_TRANSMIT = b"\xF0\xC1"
 ISM_SERVICE_READ_ALL = b"\xF0\xD0"
+ISM_SERVICE_GET_VALUE = b"\xF0\x05"
+ISM_SERVICE_GET_VALUE_RES = b"\xF0\x85"
 ISM_ACK_DP_OBJ = b"\x00\x00" + b"\x00\x00" + b"\x00"
 ISM_ACK_DP_MSG = (
     ISM_HEADER + b"\x00\x11" + ISM_CONN_HEADER + ISM_SERVICE_ACK + ISM_ACK_DP_OBJ
 )
 ISM_REQ_DP_MSG = ISM_HEADER + b"\x00\x16" + ISM_CONN_HEADER + ISM_SERVICE_READ_ALL
+ISM_MSG_OVERHEAD = 16
+# bytes of a message in front of the first datapoint (headers, service, counts)
+ISM_MAX_FRAME_SIZE = 256
+# largest frame sent to ISM8 when packing several datapoints into one message
+ISM_MAX_PENDING_WRITES = 32
+# max. number of writes waiting for confirmation by ISM8
+ISM_WRITE_TIMEOUT = 5.0
+# seconds to wait for ISM8 to report a written value back
+ISM_WRITE_RETRIES = 2
+# number of times an unconfirmed write is repeated
+ISM_WRITE_WINDOW = 0.5
+# seconds in which queued writes of a datapoint are coalesced into one
+ISM_WRITE_MIN_INTERVAL = 0.1
+# min. seconds between two frames sent by the write queue
+ISM_MAX_QUEUED_WRITES = 64
+# max. number of datapoints waiting in the write queue
+ISM_FW_AUTO = "auto"
+# firmware version setting: detect from the datapoints sent by ISM8
+ISM_FW_DETECT_DELAY = 10.0
+# seconds after connect until the firmware version is detected
+ISM_SILENCE_TIMEOUT = 300.0
+# seconds without a frame from ISM8 until its values are considered stale
+ISM_RESYNC_INTERVAL = 60.0
+# min. seconds between two 'request all datapoints' by the supervisor
+ISM_REFRESH_MAX_GAP = 4
+# stale datapoints with at most this many ids between them share one request
+ISM_REFRESH_FULL_RATIO = 0.5
+# if more than this share of the cached values is stale, all are requested
 # constant byte arrays for creating ISM8 network messages
 # Msg: ISM_HEADER || bytearray(LENGTH_MSG) || ISM_CONN_HEADER || ISM_SERVICE_XX ||
 
@@ -0,0 +1,127 @@
+"""
+Queue for calling (async) callbacks outside of the protocol handling
+"""
+
+import logging
+import asyncio
+import itertools
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+DISPATCH_DROP_OLDEST = "drop_oldest"
+# when the queue is full, the oldest callback is dropped
+DISPATCH_COALESCE = "coalesce"
+# a queued callback for the same datapoint is replaced by the newer update
+DISPATCH_BACKPRESSURE = "backpressure"
+# when the queue is full, reading from ISM8 is paused until it is drained
+
+# tasks of coroutine callbacks, kept until done
+_background_tasks = set()
+
+
+def run_callback(cb, *args) -> None:
+    """calls cb, coroutines returned by cb are scheduled as task"""
+    result = cb(*args)
+    if asyncio.iscoroutine(result):
+        task = asyncio.get_running_loop().create_task(result)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+class DispatchQueue:
+    """
+    Bounded queue of callbacks, drained by a worker task. Coroutine callbacks
+    are awaited by the worker, so a slow consumer never blocks the protocol.
+    What happens if the queue is full depends on the overflow policy.
+    """
+
+    def __init__(self, maxsize: int = 1000, overflow: str = DISPATCH_DROP_OLDEST):
+        self._maxsize = maxsize
+        self._overflow = overflow
+        # key -> (callback, args). Keys are (callback, dp_id) for coalescing
+        self._queue = OrderedDict()
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+        self._pause = None
+        self._resume = None
+        self._paused = False
+        self.dropped = 0
+        self.coalesced = 0
+        return
+
+    def set_flow_control(self, pause, resume) -> None:
+        """sets functions to pause/resume the producer (backpressure policy)"""
+        self._pause = pause
+        self._resume = resume
+
+    def qsize(self) -> int:
+        return len(self._queue)
+
+    def put(self, cb, args: tuple, dp_id=None) -> None:
+        """queues cb(*args), never blocks"""
+        if self._overflow == DISPATCH_COALESCE and dp_id is not None:
+            key = (cb, dp_id)
+            if key in self._queue:
+                self._queue[key] = (cb, args)
+                self.coalesced += 1
+                return
+        else:
+            key = next(self._counter)
+
+        if len(self._queue) >= self._maxsize:
+            if self._overflow == DISPATCH_BACKPRESSURE:
+                if not self._paused and self._pause is not None:
+                    log.debug("dispatch queue full, pausing reading")
+                    self._paused = True
+                    self._pause()
+            else:
+                self._queue.popitem(last=False)
+                self.dropped += 1
+        self._queue[key] = (cb, args)
+        self._idle.clear()
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._worker())
+
+    def stop(self) -> None:
+        """stops the worker, queued callbacks are discarded"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._queue.clear()
+        self._idle.set()
+        if self._paused:
+            # nothing is left to drain, the producer must not stay paused
+            self._paused = False
+            if self._resume is not None:
+                self._resume()
+
+    async def join(self) -> None:
+        """waits until all queued callbacks have been called"""
+        await self._idle.wait()
+
+    async def _worker(self) -> None:
+        while True:
+            if not self._queue:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, (cb, args) = self._queue.popitem(last=False)
+            try:
+                result = cb(*args)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                log.exception("error in callback %s", cb)
+            if self._paused and len(self._queue) <= self._maxsize // 2:
+                log.debug("dispatch queue drained, resuming reading")
+                self._paused = False
+                if self._resume is not None:
+                    self._resume()
+            # give the protocol a chance to run between callbacks
+            await asyncio.sleep(0)
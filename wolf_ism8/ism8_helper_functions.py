@@ -14,20 +14,37 @@ def decode_dict(mode_number: int, mode_dic: dict) -> str | None:
         return None
 
 
+# id of mode dictionary -> (mode dictionary, mode -> number), built on first use
+_REVERSE_MODES = {}
+# marks modes with more than one number in a mode dictionary
+_AMBIGUOUS = -1
+
+
+def reverse_modes(mode_dic: dict) -> dict:
+    """returns the reverse map mode -> ISM-Mode number of a mode dictionary"""
+    cached = _REVERSE_MODES.get(id(mode_dic))
+    if cached is not None and cached[0] is mode_dic:
+        return cached[1]
+    reverse = {}
+    for number, mode in mode_dic.items():
+        reverse[mode] = _AMBIGUOUS if mode in reverse else number
+    _REVERSE_MODES[id(mode_dic)] = (mode_dic, reverse)
+    return reverse
+
+
 def encode_dict(mode: str, mode_dic: dict) -> bytearray | None:
     """encodes a string into corresponding ISM-Mode numbers"""
-    entry_list = [item[0] for item in mode_dic.items() if item[1] == mode]
-    if not entry_list:
+    number = reverse_modes(mode_dic).get(mode)
+    if number is None:
         log.error(f"error encoding {mode}")
         log.error(f"available modes: {mode_dic.items()}")
         return None
-    if len(entry_list) == 1:
-        # the bytearray-constructor NEEDS a list with one entry!
-        # do not cast the mode-number on its own
-        return bytearray(entry_list)
-    else:
+    if number == _AMBIGUOUS:
         log.error(f"error encoding mode {mode}, matching not exact ")
         return None
+    # the bytearray-constructor NEEDS a list with one entry!
+    # do not cast the mode-number on its own
+    return bytearray([number])
 
 
 def decode_Scaling(input: int) -> float:
@@ -65,6 +82,60 @@ def decode_Float(input: int) -> float | None:
     return decoded_float
 
 
+# decoded values of all 65536 raw 2-byte floats, built on first use
+_FLOAT_TABLE = None
+
+
+def _build_float_table() -> list:
+    global _FLOAT_TABLE
+    _FLOAT_TABLE = [decode_Float(raw) for raw in range(0x10000)]
+    return _FLOAT_TABLE
+
+
+def decode_Float_table(input: int) -> float | None:
+    """same as decode_Float, but looks up the value in a precomputed table"""
+    return (_FLOAT_TABLE or _build_float_table())[input & 0xFFFF]
+
+
+def decode_Float_bulk(input: list) -> list:
+    """decodes a list of raw 2-byte floats via the precomputed table"""
+    table = _FLOAT_TABLE or _build_float_table()
+    try:
+        return list(map(table.__getitem__, input))
+    except IndexError:
+        return [table[raw & 0xFFFF] for raw in input]
+
+
+def decode_Power(input: int) -> float | None:
+    value = decode_Float(input)
+    if value is not None and value > 1000:
+        # ignore invalid data, not clear where it comes from...
+        return None
+    return value
+
+
+def decode_Power_table(input: int) -> float | None:
+    value = decode_Float_table(input)
+    if value is not None and value > 1000:
+        return None
+    return value
+
+
+def decode_Power_bulk(input: list) -> list:
+    return [
+        None if value is not None and value > 1000 else value
+        for value in decode_Float_bulk(input)
+    ]
+
+
+def decode_FlowRate(input: int) -> float | None:
+    value = 0.0001 * decode_Int(input)
+    if value > 1000:
+        # ignore wrong data, not clear where it comes from...
+        return None
+    return value
+
+
 def encode_Float(input: float) -> bytearray:
     input = round(input, 2)
     data = [0, 0]
@@ -87,6 +158,29 @@ def encode_Float(input: float) -> bytearray:
     return encoded_float
 
 
+# encoded values of all allowed float setpoints, built on first use
+_FLOAT_ENCODINGS = None
+
+
+def _build_float_encodings() -> dict:
+    global _FLOAT_ENCODINGS
+    _FLOAT_ENCODINGS = {}
+    for dp_id, allowed_values in DP_VALUES_ALLOWED.items():
+        datatype = DATATYPES[DATAPOINTS[dp_id][IX_TYPE]]
+        if datatype[DT_PYTHONTYPE] is float and datatype[DT_LENGTH] == 2:
+            for value in allowed_values:
+                _FLOAT_ENCODINGS[value] = bytes(encode_Float(value))
+    return _FLOAT_ENCODINGS
+
+
+def encode_Float_table(input: float) -> bytearray:
+    """same as encode_Float, but looks up allowed setpoints in an index"""
+    encoded = (_FLOAT_ENCODINGS or _build_float_encodings()).get(input)
+    if encoded is None:
+        return encode_Float(input)
+    return bytearray(encoded)
+
+
 def decode_date(input: int) -> datetime.date:
     year = input & 0b000000000000000001111111
     month = (input & 0b000000000000111100000000) >> 8
@@ -119,6 +213,17 @@ def encode_time_of_day(input: datetime.time) -> bytearray:
     return encoded_time
 
 
+# allowed values of writable datapoints, precomputed for validation:
+# string values as frozenset, all others as (min, max)
+DP_VALUES_ALLOWED_SET = {}
+DP_VALUE_BOUNDS = {}
+for _dp_id, _allowed_values in DP_VALUES_ALLOWED.items():
+    if all(isinstance(_value, str) for _value in _allowed_values):
+        DP_VALUES_ALLOWED_SET[_dp_id] = frozenset(_allowed_values)
+    else:
+        DP_VALUE_BOUNDS[_dp_id] = (min(_allowed_values), max(_allowed_values))
+
+
 def validate_dp_range(dp_id: int, value) -> bool:
     """
     checks if value is valid for the datapoint before sending to ISM
@@ -137,13 +242,16 @@ def validate_dp_range(dp_id: int, value) -> bool:
 
     # check if value is in allowed range
     if isinstance(value, str):
-        if value not in DP_VALUES_ALLOWED[dp_id]:
-            log.error(f"value {value} is out of range")
+        allowed_values = DP_VALUES_ALLOWED_SET.get(dp_id, frozenset())
+        if value not in allowed_values:
+            log.error(f"value {value} is out of range {sorted(allowed_values)}")
             return False
     else:
-        if (value > max(DP_VALUES_ALLOWED[dp_id])) or (
-            value < min(DP_VALUES_ALLOWED[dp_id])
-        ):
-            log.error(f"value {value} is out of range")
+        if dp_id not in DP_VALUE_BOUNDS:
+            log.error(f"no value range defined for datapoint {dp_id}")
+            return False
+        min_value, max_value = DP_VALUE_BOUNDS[dp_id]
+        if value > max_value or value < min_value:
+            log.error(f"value {value} is out of range [{min_value}, {max_value}]")
             return False
     return True
@@ -0,0 +1,102 @@
+"""
+Fixed-size history of numeric datapoint values for trends and statistics
+"""
+
+import time
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class DatapointHistory:
+    """
+    Ring buffer of (monotonic timestamp, value) samples of one datapoint.
+    Every sample is written twice (at i and i + depth), so the last <depth>
+    samples are always one contiguous slice of the buffers and can be
+    exported without copying.
+    """
+
+    __slots__ = ("_depth", "_timestamps", "_values", "_next", "_count")
+
+    def __init__(self, depth: int = 1000):
+        self._depth = depth
+        self._timestamps = array("d", bytes(16 * depth))
+        self._values = array("d", bytes(16 * depth))
+        self._next = 0
+        self._count = 0
+        return
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, value: float) -> None:
+        index = self._next
+        mirror = index + self._depth
+        self._timestamps[index] = self._timestamps[mirror] = timestamp
+        self._values[index] = self._values[mirror] = value
+        self._next = (index + 1) % self._depth
+        if self._count < self._depth:
+            self._count += 1
+
+    def _bounds(self, seconds=None, now=None) -> tuple:
+        """returns start and end index of the samples within the time window"""
+        end = self._next + self._depth if self._count == self._depth else self._next
+        start = end - self._count
+        if seconds is not None:
+            if now is None:
+                now = time.monotonic()
+            start = bisect_left(self._timestamps, now - seconds, start, end)
+        return start, end
+
+    def samples(self, seconds=None, now=None) -> list:
+        """returns (timestamp, value) tuples, oldest first"""
+        start, end = self._bounds(seconds, now)
+        return list(zip(self._timestamps[start:end], self._values[start:end]))
+
+    def stats(self, seconds=None, now=None) -> tuple | None:
+        """returns (min, max, mean) of the last <seconds>, None if no samples"""
+        start, end = self._bounds(seconds, now)
+        if start == end:
+            return None
+        if numpy is not None:
+            values = numpy.frombuffer(self._values, dtype=numpy.float64)[start:end]
+            return float(values.min()), float(values.max()), float(values.mean())
+        values = self._values[start:end]
+        return min(values), max(values), sum(values) / len(values)
+
+    def as_numpy(self, seconds=None, now=None) -> tuple:
+        """returns (timestamps, values) as numpy arrays sharing the buffers"""
+        if numpy is None:
+            raise ImportError("numpy is required for as_numpy()")
+        start, end = self._bounds(seconds, now)
+        timestamps = numpy.frombuffer(self._timestamps, dtype=numpy.float64)
+        values = numpy.frombuffer(self._values, dtype=numpy.float64)
+        return timestamps[start:end], values[start:end]
+
+
+class HistoryBuffer:
+    """histories of all numeric datapoints, created on first value"""
+
+    def __init__(self, depth: int = 1000, dp_ids=None):
+        self._depth = depth
+        self._dp_ids = None if dp_ids is None else frozenset(dp_ids)
+        self._histories = {}
+        return
+
+    def add(self, updates: list, timestamp: float) -> None:
+        for dp_id, value in updates:
+            if not isinstance(value, (int, float)):
+                continue
+            history = self._histories.get(dp_id)
+            if history is None:
+                if self._dp_ids is not None and dp_id not in self._dp_ids:
+                    continue
+                history = self._histories[dp_id] = DatapointHistory(self._depth)
+            history.append(timestamp, value)
+
+    def get(self, dp_id: int) -> DatapointHistory | None:
+        return self._histories.get(dp_id)
@@ -0,0 +1,92 @@
+"""
+Immutable indexes over the static datapoint tables, built once at import
+"""
+
+from types import MappingProxyType
+from .ism8_constants import *
+
+
+def _first_fw_version(dp_id: int) -> str:
+    if 191 < dp_id < 208:
+        return "1.50"
+    if dp_id in (209, 210, 211, 251):
+        return "1.70"
+    if 354 < dp_id < 362:
+        return "1.70"
+    if 363 < dp_id < 373:
+        return "1.80"
+    if 211 < dp_id < 251:
+        return "1.80"
+    return "1.00"
+
+
+def version_key(version: str) -> tuple:
+    """
+    returns a firmware version like '1.80' as comparable tuple (1, 80). The
+    minor version has two digits, '1.8' is 1.80. Raises ValueError if the
+    version is malformed
+    """
+    major, _, minor = version.partition(".")
+    if not major.isdigit() or not minor.isdigit() or len(minor) > 2:
+        raise ValueError(f"invalid firmware version: {version}")
+    return int(major), int(minor.ljust(2, "0"))
+
+
+def _index(key_func) -> MappingProxyType:
+    index = {}
+    for dp_id in sorted(DATAPOINTS):
+        index.setdefault(key_func(dp_id), []).append(dp_id)
+    return MappingProxyType({key: tuple(ids) for key, ids in index.items()})
+
+
+ALL_DEVICES = tuple(sorted({dp[IX_DEVICENAME] for dp in DATAPOINTS.values()}))
+DEVICE_DATAPOINTS = _index(lambda dp_id: DATAPOINTS[dp_id][IX_DEVICENAME])
+DPT_DATAPOINTS = _index(lambda dp_id: DATAPOINTS[dp_id][IX_TYPE])
+WRITABLE_DATAPOINTS = frozenset(
+    dp_id for dp_id, dp in DATAPOINTS.items() if dp[IX_RW_FLAG]
+)
+DP_UNITS = MappingProxyType(
+    {
+        dp_id: DATATYPES[dp[IX_TYPE]][DT_UNIT]
+        for dp_id, dp in DATAPOINTS.items()
+        if dp[IX_TYPE] in DATATYPES
+    }
+)
+DP_FIRST_FW_VERSION = MappingProxyType(
+    {dp_id: _first_fw_version(dp_id) for dp_id in DATAPOINTS}
+)
+# firmware version -> datapoints introduced with this version
+FW_VERSION_DATAPOINTS = _index(lambda dp_id: DP_FIRST_FW_VERSION[dp_id])
+FW_VERSIONS = tuple(sorted(FW_VERSION_DATAPOINTS, key=version_key))
+
+# firmware version -> all datapoints supported, filled on first query
+_FW_SUPPORTED_DATAPOINTS = {}
+
+
+def first_fw_version(dp_id: int) -> str:
+    """returns first ISM8-firmware version of datapoint implementation"""
+    version = DP_FIRST_FW_VERSION.get(dp_id)
+    if version is None:
+        return _first_fw_version(dp_id)
+    return version
+
+
+def datapoints_for_firmware(version: str) -> frozenset:
+    """
+    returns ids of all datapoints supported by an ISM8-firmware version,
+    an empty set if the version is malformed
+    """
+    supported = _FW_SUPPORTED_DATAPOINTS.get(version)
+    if supported is None:
+        try:
+            key = version_key(version)
+        except ValueError:
+            return frozenset()
+        supported = frozenset(
+            dp_id
+            for fw_version, dp_ids in FW_VERSION_DATAPOINTS.items()
+            if version_key(fw_version) <= key
+            for dp_id in dp_ids
+        )
+        _FW_SUPPORTED_DATAPOINTS[version] = supported
+    return supported
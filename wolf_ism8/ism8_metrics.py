@@ -0,0 +1,183 @@
+"""
+Counters and histograms of the protocol handling, with text exposition
+"""
+
+import logging
+import asyncio
+from bisect import bisect_left
+from .ism8_constants import *
+
+log = logging.getLogger(__name__)
+
+DROP_NO_HEADER = "no_header"
+# received data without ISM8 header
+DROP_BROKEN_HEADER = "broken_header"
+# header with impossible frame size
+DROP_SHORT_FRAME = "short_frame"
+# frame shorter than its datapoints
+DROP_ZERO_LENGTH = "zero_length"
+# datapoint without value, the whole frame is dropped
+DROP_UNKNOWN_DP = "unknown_dp"
+# datapoint id not in DATAPOINTS
+DROP_INVALID_VALUE = "invalid_value"
+# value which cannot be decoded, e.g. out-of-range float
+
+DECODE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 1e-3)
+CALLBACK_BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 0.1, 1.0)
+WRITE_RTT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """counts observations in buckets with upper bounds, plus sum and count"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # one count per bucket and one for +Inf, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self) -> dict:
+        """returns count, sum and cumulative counts per upper bound"""
+        cumulative = {}
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative[bound] = total
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Metrics:
+    """
+    Instrumentation of an Ism8 instance. Counters are always updated, drops
+    are only counted on the (rare) error paths. Decode and callback latency
+    are measured for one of sample_interval frames only.
+    """
+
+    def __init__(self, sample_interval: int = 100):
+        self.frames_received = 0
+        self.frames_acked = 0
+        # reason -> number of dropped frames or datapoints
+        self.dropped = {}
+        # datatype -> Histogram of decode time per datapoint
+        self.decode_latency = {}
+        self.callback_latency = Histogram(CALLBACK_BUCKETS)
+        self.write_rtt = Histogram(WRITE_RTT_BUCKETS)
+        self.sample_interval = sample_interval
+        self._countdown = 1
+        return
+
+    def sample(self) -> bool:
+        """returns True for every sample_interval-th frame (and the first)"""
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = self.sample_interval
+        return True
+
+    def drop(self, reason: str, count: int = 1) -> None:
+        self.dropped[reason] = self.dropped.get(reason, 0) + count
+
+    def observe_decode(self, dp_id: int, seconds: float) -> None:
+        dp_type = DATAPOINTS.get(dp_id, (None, None, "unknown"))[IX_TYPE]
+        histogram = self.decode_latency.get(dp_type)
+        if histogram is None:
+            histogram = self.decode_latency[dp_type] = Histogram(DECODE_BUCKETS)
+        histogram.observe(seconds)
+
+    def as_dict(self) -> dict:
+        return {
+            "frames_received": self.frames_received,
+            "frames_acked": self.frames_acked,
+            "frames_dropped": dict(self.dropped),
+            "decode_latency": {
+                dp_type: histogram.as_dict()
+                for dp_type, histogram in self.decode_latency.items()
+            },
+            "callback_latency": self.callback_latency.as_dict(),
+            "write_rtt": self.write_rtt.as_dict(),
+        }
+
+    def exposition(self, prefix: str = "wolf_ism8", labels: dict | None = None) -> str:
+        """returns the metrics in Prometheus text exposition format"""
+        labels = labels or {}
+        lines = []
+        for name, value in (
+            ("frames_received_total", self.frames_received),
+            ("frames_acked_total", self.frames_acked),
+        ):
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.append(f"{prefix}_{name}{_labels(labels)} {value}")
+        lines.append(f"# TYPE {prefix}_dropped_total counter")
+        for reason, count in sorted(self.dropped.items()):
+            reason_labels = _labels({**labels, "reason": reason})
+            lines.append(f"{prefix}_dropped_total{reason_labels} {count}")
+        lines.append(f"# TYPE {prefix}_decode_seconds histogram")
+        for dp_type, histogram in sorted(self.decode_latency.items()):
+            lines.extend(
+                _histogram_lines(
+                    f"{prefix}_decode_seconds", histogram, {**labels, "dpt": dp_type}
+                )
+            )
+        for name, histogram in (
+            ("callback_seconds", self.callback_latency),
+            ("write_rtt_seconds", self.write_rtt),
+        ):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            lines.extend(_histogram_lines(f"{prefix}_{name}", histogram, labels))
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _histogram_lines(name: str, histogram: Histogram, labels: dict) -> list:
+    lines = []
+    for bound, count in histogram.as_dict()["buckets"].items():
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {count}")
+    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+    return lines
+
+
+async def serve_metrics(exposition, host: str = "127.0.0.1", port: int = 9508):
+    """
+    serves the text returned by exposition() over HTTP, for every request,
+    e.g. serve_metrics(ism8.get_metrics_text). Returns the asyncio server
+    """
+
+    async def handle_request(reader, writer):
+        try:
+            # the request itself does not matter
+            await reader.readuntil(b"\r\n\r\n")
+            body = exposition().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: %d\r\n\r\n" % len(body) + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            log.debug("incomplete request to metrics endpoint")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_request, host, port)
@@ -0,0 +1,122 @@
+"""
+Filter for datapoint updates, so callbacks only fire on meaningful changes
+"""
+
+import asyncio
+import time
+from .ism8_constants import *
+
+
+class NotificationFilter:
+    """
+    Decides whether a received datapoint value is worth a callback. A value is
+    notified if it differs from the last notified value by more than the
+    deadband of the datapoint (or of its datatype) and the last notification
+    is at least min_interval seconds ago. A change within min_interval is
+    notified when the interval has passed (trailing notification), if a
+    trailing callback is set and an event loop is running. After max_interval
+    seconds, a value is notified even if it did not change (heartbeat). The
+    heartbeat is checked when an update arrives, it does not fire by itself.
+    """
+
+    def __init__(self, min_interval: float = 0.0, max_interval: float | None = None):
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._deadband_by_dp = {}
+        self._deadband_by_type = {}
+        # dp_id -> last notified value and monotonic time of notification
+        self._last_value = {}
+        self._last_time = {}
+        # dp_id -> latest suppressed value and timer of its notification
+        self._pending = {}
+        self._timers = {}
+        self._on_trailing = None
+        return
+
+    def set_trailing_callback(self, cb) -> None:
+        """cb(dp_id, value) is called for trailing notifications"""
+        self._on_trailing = cb
+
+    def set_deadband(self, deadband: float, dp_id=None, dp_type=None) -> None:
+        """sets the deadband for a single datapoint or for all of a datatype"""
+        if dp_id is not None:
+            self._deadband_by_dp[dp_id] = deadband
+        elif dp_type is not None:
+            self._deadband_by_type[dp_type] = deadband
+
+    def set_interval(self, min_interval: float = 0.0, max_interval=None) -> None:
+        """sets min. time between notifications and max. time without one"""
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+
+    def get_deadband(self, dp_id: int) -> float:
+        if dp_id in self._deadband_by_dp:
+            return self._deadband_by_dp[dp_id]
+        dp_type = DATAPOINTS.get(dp_id, ("", "", "", ""))[IX_TYPE]
+        return self._deadband_by_type.get(dp_type, 0.0)
+
+    def should_notify(self, dp_id: int, value, now: float | None = None) -> bool:
+        """checks value against the last notified one, remembers it if notified"""
+        if now is None:
+            now = time.monotonic()
+        if dp_id in self._last_time:
+            elapsed = now - self._last_time[dp_id]
+            heartbeat = self._max_interval is not None and elapsed >= self._max_interval
+            if not heartbeat:
+                if not self._has_changed(dp_id, value):
+                    self._cancel_pending(dp_id)
+                    return False
+                if elapsed < self._min_interval:
+                    self._set_pending(dp_id, value, self._min_interval - elapsed)
+                    return False
+        self._cancel_pending(dp_id)
+        self._last_value[dp_id] = value
+        self._last_time[dp_id] = now
+        return True
+
+    def reset(self, dp_id=None) -> None:
+        """forgets the last notified values, so the next update is notified"""
+        if dp_id is None:
+            for pending_dp_id in list(self._pending):
+                self._cancel_pending(pending_dp_id)
+            self._last_value.clear()
+            self._last_time.clear()
+        else:
+            self._cancel_pending(dp_id)
+            self._last_value.pop(dp_id, None)
+            self._last_time.pop(dp_id, None)
+
+    def _set_pending(self, dp_id: int, value, delay: float) -> None:
+        if self._on_trailing is None:
+            return
+        self._pending[dp_id] = value
+        if dp_id not in self._timers:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # without event loop, the change is only notified by a later update
+                self._pending.pop(dp_id)
+                return
+            self._timers[dp_id] = loop.call_later(delay, self._notify_pending, dp_id)
+
+    def _cancel_pending(self, dp_id: int) -> None:
+        self._pending.pop(dp_id, None)
+        timer = self._timers.pop(dp_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _notify_pending(self, dp_id: int) -> None:
+        self._timers.pop(dp_id, None)
+        if dp_id not in self._pending:
+            return
+        value = self._pending.pop(dp_id)
+        self._last_value[dp_id] = value
+        self._last_time[dp_id] = time.monotonic()
+        if self._on_trailing is not None:
+            self._on_trailing(dp_id, value)
+
+    def _has_changed(self, dp_id: int, value) -> bool:
+        last_value = self._last_value[dp_id]
+        if isinstance(value, (int, float)) and isinstance(last_value, (int, float)):
+            return abs(value - last_value) > self.get_deadband(dp_id)
+        return value != last_value
@@ -0,0 +1,82 @@
+"""
+Timing of the stages of frame processing, keeping the slowest frames
+"""
+
+import heapq
+import itertools
+import time
+from typing import NamedTuple
+
+STAGE_FRAMING = "framing"
+# finding header and frame boundaries in the receive buffer
+STAGE_DECODE = "decode"
+# decoding the datapoints of the frame
+STAGE_STORE = "store"
+# storing values, history, write confirmation and notification filter
+STAGE_CALLBACKS = "callbacks"
+# calling (or queueing) callbacks
+
+
+class FrameProfile(NamedTuple):
+    """processing time of a received frame, total and per stage"""
+
+    total: float
+    frame: bytes
+    stages: dict
+    timestamp: float
+
+
+class FrameProfiler:
+    """
+    Times the processing stages of one of sample_interval received frames.
+    Timing hooks are called with (stage, seconds) for every stage of a
+    profiled frame. The <slowest> frames are kept with their raw bytes.
+    """
+
+    def __init__(self, slowest: int = 10, sample_interval: int = 1):
+        self._slowest = slowest
+        self.sample_interval = sample_interval
+        self._countdown = 1
+        self._hooks = []
+        # min-heap of (total, sequence number, FrameProfile)
+        self._heap = []
+        self._sequence = itertools.count()
+        self.frames_profiled = 0
+        return
+
+    def add_hook(self, hook) -> None:
+        """hook(stage, seconds) is called for every stage of profiled frames"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook) -> None:
+        self._hooks.remove(hook)
+
+    def sample(self) -> bool:
+        """returns True for every sample_interval-th frame (and the first)"""
+        self._countdown -= 1
+        if self._countdown:
+            return False
+        self._countdown = self.sample_interval
+        return True
+
+    def record(self, frame, stages: dict) -> None:
+        """records the stage durations of a frame, raw bytes are copied if kept"""
+        self.frames_profiled += 1
+        for hook in self._hooks:
+            for stage, seconds in stages.items():
+                hook(stage, seconds)
+        total = sum(stages.values())
+        if len(self._heap) >= self._slowest:
+            if not self._heap or total <= self._heap[0][0]:
+                return
+            heapq.heappop(self._heap)
+        profile = FrameProfile(total, bytes(frame), stages, time.monotonic())
+        heapq.heappush(self._heap, (total, next(self._sequence), profile))
+
+    def get_slowest(self) -> list:
+        """returns the FrameProfiles of the slowest frames, slowest first"""
+        return [entry[2] for entry in sorted(self._heap, reverse=True)]
+
+    def reset(self) -> None:
+        self._heap.clear()
+        self.frames_profiled = 0
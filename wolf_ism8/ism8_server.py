@@ -0,0 +1,99 @@
+"""
+Module for serving several ISM8 adapters (e.g. one per building) on one listener
+"""
+
+import logging
+import asyncio
+from .ism8 import Ism8
+
+
+class Ism8Server:
+    """
+    Hub for several ISM8 modules. Every gateway gets its own Ism8 protocol
+    instance, registered by its IP address. When a gateway reconnects, the
+    connection is handed over to its existing instance, so cached values and
+    callbacks are kept.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(self, firmware_version: str | None = None):
+        # firmware version for new gateways, see Ism8
+        self._firmware_version = firmware_version
+        # gateway IP -> Ism8 instance
+        self._gateways = {}
+        # callbacks for newly connected gateways
+        self._callback_on_gateway = []
+        return
+
+    def factory(self):
+        return _Ism8Connection(self)
+
+    def get_gateways(self) -> list:
+        """returns IP addresses of all gateways which have connected so far"""
+        return list(self._gateways.keys())
+
+    def get_gateway(self, gateway: str) -> Ism8 | None:
+        """returns the Ism8 instance of a gateway"""
+        return self._gateways.get(gateway)
+
+    def register_gateway_callback(self, cb):
+        """cb(gateway, ism8) is called when a gateway connects for the first time"""
+        self._callback_on_gateway.append(cb)
+
+    def remove_gateway_callback(self, cb):
+        self._callback_on_gateway.remove(cb)
+
+    def read_sensor(self, gateway: str, dp_id: int):
+        """returns sensor value of a gateway, None if gateway or value is unknown"""
+        ism8 = self._gateways.get(gateway)
+        if ism8 is None:
+            return None
+        return ism8.read_sensor(dp_id)
+
+    def send_dp_value(self, gateway: str, dp_id: int, value) -> bool:
+        """sends value for a (writable) datapoint to a gateway"""
+        ism8 = self._gateways.get(gateway)
+        if ism8 is None:
+            Ism8Server.log.error(f"unknown gateway: {gateway}")
+            return False
+        return ism8.send_dp_value(dp_id, value)
+
+    async def async_send_dp_value(self, gateway: str, dp_id: int, value) -> bool:
+        """sends value to a gateway and waits for confirmation"""
+        ism8 = self._gateways.get(gateway)
+        if ism8 is None:
+            Ism8Server.log.error(f"unknown gateway: {gateway}")
+            return False
+        return await ism8.async_send_dp_value(dp_id, value)
+
+    def _attach(self, transport) -> None:
+        """hands a new connection over to the Ism8 instance of its gateway"""
+        gateway = transport.get_extra_info("peername")[0]
+        ism8 = self._gateways.get(gateway)
+        new_gateway = ism8 is None
+        if new_gateway:
+            ism8 = Ism8(self._firmware_version)
+            self._gateways[gateway] = ism8
+        elif ism8.connected() and ism8._transport is not None:
+            # the old connection is probably dead, but not detected yet.
+            # Detach it, so its connection_lost does not hit the instance
+            Ism8Server.log.info(f"gateway {gateway} reconnected, closing old link")
+            old_transport = ism8._transport
+            old_transport.set_protocol(asyncio.Protocol())
+            old_transport.close()
+        transport.set_protocol(ism8)
+        ism8.connection_made(transport)
+        if new_gateway:
+            for cb in self._callback_on_gateway:
+                cb(gateway, ism8)
+
+
+class _Ism8Connection(asyncio.Protocol):
+    """placeholder protocol until the peer of a new connection is known"""
+
+    def __init__(self, server: Ism8Server):
+        self._server = server
+
+    def connection_made(self, transport) -> None:
+        self._server._attach(transport)
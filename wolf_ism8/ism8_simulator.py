@@ -0,0 +1,227 @@
+"""
+Simulation of an ISM8 module for tests and benchmarks without hardware
+"""
+
+import logging
+import asyncio
+import datetime
+from .ism8_constants import *
+from .ism8_helper_functions import *
+
+log = logging.getLogger(__name__)
+
+# command byte of datapoints sent by ISM8 (see network messages of the device)
+ISM_DP_CMD_SET = 3
+
+MALFORMED_GARBAGE = "garbage"
+# random bytes without ISM8 header
+MALFORMED_ZERO_LENGTH = "zero_length"
+# datapoint without data, must not be acknowledged
+MALFORMED_TRUNCATED = "truncated"
+# datapoint count larger than the datapoints in the frame
+MALFORMED_BROKEN_HEADER = "broken_header"
+# frame length smaller than the header
+
+
+# undocumented datapoints are sent as one byte
+_UNKNOWN_DATATYPE = (None, None, int, None, None, 1)
+
+
+def _datatype(dp_id: int) -> tuple:
+    return DATATYPES.get(DATAPOINTS[dp_id][IX_TYPE], _UNKNOWN_DATATYPE)
+
+
+def default_raw_value(dp_id: int) -> bytes:
+    """returns a valid encoded value for a datapoint, according to its type"""
+    datatype = _datatype(dp_id)
+    python_type = datatype[DT_PYTHONTYPE]
+    length = datatype[DT_LENGTH]
+    if python_type is float and length == 2:
+        return bytes(encode_Float(20.0))
+    if python_type is datetime.date:
+        return bytes(encode_date(datetime.date(2024, 1, 1)))
+    if python_type is datetime.time:
+        return bytes(encode_time_of_day(datetime.time(12, 0)))
+    return bytes(length)
+
+
+def build_dp_frame(encoded_values: list, service=ISM_SERVICE_RECEIVE) -> bytearray:
+    """
+    builds a frame as sent by ISM8 for a list of (dp_id, encoded_value)
+    """
+    frame = bytearray(ISM_HEADER)
+    frame.extend(b"\x00\x00")
+    frame.extend(ISM_CONN_HEADER)
+    frame.extend(service)
+    frame.extend(encoded_values[0][0].to_bytes(2, byteorder="big"))
+    frame.extend(len(encoded_values).to_bytes(2, byteorder="big"))
+    for dp_id, encoded_value in encoded_values:
+        frame.extend(dp_id.to_bytes(2, byteorder="big"))
+        frame.append(ISM_DP_CMD_SET)
+        frame.append(len(encoded_value))
+        frame.extend(encoded_value)
+    frame[4:6] = len(frame).to_bytes(2, byteorder="big")
+    return frame
+
+
+class Ism8Simulator:
+    """
+    Connects to the server of the library like an ISM8 module. Answers
+    'request all datapoints' with a dump of all datapoints and 'get datapoint
+    value' with the requested datapoints, reports written
+    values back and can send update storms, split frames into several TCP
+    writes and inject malformed frames.
+    """
+
+    def __init__(self, values: dict | None = None, split_size=None, dp_per_frame=50):
+        # dp_id -> encoded value
+        if values is None:
+            values = {dp_id: default_raw_value(dp_id) for dp_id in DATAPOINTS}
+        self._values = values
+        self._split_size = split_size
+        self._dp_per_frame = dp_per_frame
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self.frames_sent = 0
+        self.acks_received = 0
+        self.writes_received = 0
+        self.dump_requests = 0
+        self.value_requests = 0
+        return
+
+    def set_value(self, dp_id: int, encoded_value: bytes) -> None:
+        self._values[dp_id] = bytes(encoded_value)
+
+    async def connect(self, host: str, port: int, local_addr=None) -> None:
+        self._reader, self._writer = await asyncio.open_connection(
+            host, port, local_addr=local_addr
+        )
+        self._reader_task = asyncio.get_running_loop().create_task(self._read())
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def send_frame(self, frame) -> None:
+        """writes a frame, split into chunks of split_size bytes if set"""
+        if self._split_size:
+            for ptr in range(0, len(frame), self._split_size):
+                self._writer.write(frame[ptr : ptr + self._split_size])
+                await self._writer.drain()
+        else:
+            self._writer.write(frame)
+            await self._writer.drain()
+        self.frames_sent += 1
+
+    async def send_values(self, dp_ids) -> None:
+        """sends the current values of the datapoints, packed into frames"""
+        dp_ids = sorted(dp_ids)
+        for ptr in range(0, len(dp_ids), self._dp_per_frame):
+            chunk = dp_ids[ptr : ptr + self._dp_per_frame]
+            await self.send_frame(
+                build_dp_frame([(dp_id, self._values[dp_id]) for dp_id in chunk])
+            )
+
+    async def send_all(self) -> None:
+        """sends all datapoints, like ISM8 after 'request all datapoints'"""
+        await self.send_values(self._values.keys())
+
+    async def storm(self, count: int, dp_ids=None, interval: float = 0) -> None:
+        """sends <count> frames with changing float values"""
+        if dp_ids is None:
+            dp_ids = [
+                dp_id
+                for dp_id in self._values
+                if _datatype(dp_id)[DT_PYTHONTYPE] is float
+                and _datatype(dp_id)[DT_LENGTH] == 2
+            ]
+        for counter in range(count):
+            for dp_id in dp_ids:
+                self._values[dp_id] = bytes(encode_Float(20.0 + counter % 100 / 10))
+            await self.send_values(dp_ids)
+            if interval:
+                await asyncio.sleep(interval)
+
+    async def inject_malformed(self, kind: str = MALFORMED_GARBAGE) -> None:
+        """sends a malformed frame of the given kind"""
+        if kind == MALFORMED_GARBAGE:
+            frame = bytearray(b"\x17\x42\x00\xff\x06\x20\x13\x37")
+        elif kind == MALFORMED_ZERO_LENGTH:
+            frame = build_dp_frame([(1, b"")])
+        elif kind == MALFORMED_TRUNCATED:
+            frame = build_dp_frame([(4, self._values.get(4, bytes(2)))])
+            frame[14:16] = (5).to_bytes(2, byteorder="big")
+        elif kind == MALFORMED_BROKEN_HEADER:
+            frame = bytearray(ISM_HEADER + b"\x00\x04" + ISM_CONN_HEADER)
+        else:
+            raise ValueError(f"unknown kind of malformed frame: {kind}")
+        await self.send_frame(frame)
+
+    async def _read(self) -> None:
+        """handles messages from the library"""
+        buf = bytearray()
+        while True:
+            data = await self._reader.read(4096)
+            if not data:
+                return
+            buf.extend(data)
+            while True:
+                ptr = buf.find(ISM_HEADER)
+                if ptr == -1 or len(buf) < ptr + 12:
+                    break
+                del buf[:ptr]
+                service = bytes(buf[10:12])
+                if service == ISM_SERVICE_READ_ALL:
+                    # the request is shorter than its length field
+                    del buf[:12]
+                    self.dump_requests += 1
+                    await self.send_all()
+                    continue
+                frame_size = buf[4] * 256 + buf[5]
+                if len(buf) < frame_size:
+                    break
+                frame = bytes(buf[:frame_size])
+                del buf[:frame_size]
+                if service == ISM_SERVICE_ACK:
+                    self.acks_received += 1
+                elif service == ISM_SERVICE_TRANSMIT:
+                    await self._handle_write(frame)
+                elif service == ISM_SERVICE_GET_VALUE:
+                    await self._handle_get_value(frame)
+
+    async def _handle_get_value(self, frame: bytes) -> None:
+        """answers 'get datapoint value' with the known datapoints of the range"""
+        start = frame[12] * 256 + frame[13]
+        count = frame[14] * 256 + frame[15]
+        self.value_requests += 1
+        encoded_values = [
+            (dp_id, self._values[dp_id])
+            for dp_id in range(start, start + count)
+            if dp_id in self._values
+        ]
+        if encoded_values:
+            await self.send_frame(
+                build_dp_frame(encoded_values, ISM_SERVICE_GET_VALUE_RES)
+            )
+
+    async def _handle_write(self, frame: bytes) -> None:
+        """stores written values and reports them back like ISM8"""
+        number_of_datapoints = frame[14] * 256 + frame[15]
+        ptr = 16
+        dp_ids = []
+        for _ in range(number_of_datapoints):
+            dp_id = frame[ptr] * 256 + frame[ptr + 1]
+            length = frame[ptr + 3]
+            self._values[dp_id] = frame[ptr + 4 : ptr + 4 + length]
+            dp_ids.append(dp_id)
+            ptr += 4 + length
+        self.writes_received += 1
+        log.debug("simulator received write for %s", dp_ids)
+        await self.send_values(dp_ids)
@@ -0,0 +1,174 @@
+"""
+Compact storage of datapoint values with update time and quality flag
+"""
+
+import time
+from array import array
+from collections.abc import MutableMapping
+from typing import NamedTuple
+from .ism8_constants import *
+
+QUALITY_UNKNOWN = 0
+# no value received (yet) or value invalidated
+QUALITY_GOOD = 1
+# value received from ISM8
+QUALITY_STALE = 2
+# value received, but may be outdated
+
+_MISSING = object()
+
+
+class DatapointState(NamedTuple):
+    """stored value of a datapoint with monotonic update time and quality"""
+
+    dp_id: int
+    value: object
+    timestamp: float
+    quality: int
+
+
+class DatapointStore(MutableMapping):
+    """
+    Stores datapoint values in a list of slots, one per datapoint id given
+    (default: all datapoints), with the monotonic time of the last update and
+    a quality flag in typed arrays. Only the given datapoints get a slot.
+    Behaves like a dict dp_id -> value.
+    """
+
+    __slots__ = (
+        "_offset",
+        "_slots",
+        "_ids",
+        "_values",
+        "_timestamps",
+        "_quality",
+        "_count",
+    )
+
+    def __init__(self, dp_ids=None):
+        if dp_ids is None:
+            dp_ids = DATAPOINTS.keys()
+        dp_ids = sorted(dp_ids) or [0]
+        self._offset = dp_ids[0]
+        # dp_id - offset -> slot, -1 for datapoints without slot
+        self._slots = array("h", [-1]) * (dp_ids[-1] - self._offset + 1)
+        for slot, dp_id in enumerate(dp_ids):
+            self._slots[dp_id - self._offset] = slot
+        # slot -> dp_id
+        self._ids = array("H", dp_ids)
+        size = len(dp_ids)
+        self._values = [_MISSING] * size
+        self._timestamps = array("d", bytes(8 * size))
+        self._quality = array("b", bytes(size))
+        self._count = 0
+        return
+
+    def _slot(self, dp_id: int) -> int:
+        """returns the slot of a datapoint, -1 if it has none"""
+        index = dp_id - self._offset
+        if 0 <= index < len(self._slots):
+            return self._slots[index]
+        return -1
+
+    def _index(self, dp_id: int) -> int:
+        slot = self._slot(dp_id)
+        if slot < 0:
+            raise KeyError(dp_id)
+        return slot
+
+    def __getitem__(self, dp_id: int):
+        value = self._values[self._index(dp_id)]
+        if value is _MISSING:
+            raise KeyError(dp_id)
+        return value
+
+    def __setitem__(self, dp_id: int, value) -> None:
+        self.set(dp_id, value, time.monotonic())
+
+    def __delitem__(self, dp_id: int) -> None:
+        index = self._index(dp_id)
+        if self._values[index] is _MISSING:
+            raise KeyError(dp_id)
+        self._values[index] = _MISSING
+        self._quality[index] = QUALITY_UNKNOWN
+        self._count -= 1
+
+    def __contains__(self, dp_id) -> bool:
+        slot = self._slot(dp_id)
+        return slot >= 0 and self._values[slot] is not _MISSING
+
+    def __iter__(self):
+        ids = self._ids
+        return (ids[i] for i, v in enumerate(self._values) if v is not _MISSING)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, dp_id: int, default=None):
+        slot = self._slot(dp_id)
+        if slot >= 0:
+            value = self._values[slot]
+            if value is not _MISSING:
+                return value
+        return default
+
+    def set(self, dp_id: int, value, timestamp: float, quality=QUALITY_GOOD) -> None:
+        """stores value with the (monotonic) time of the update"""
+        # inlined _index, this is called for every received value
+        index = dp_id - self._offset
+        slot = self._slots[index] if 0 <= index < len(self._slots) else -1
+        if slot < 0:
+            raise KeyError(dp_id)
+        if self._values[slot] is _MISSING:
+            self._count += 1
+        self._values[slot] = value
+        self._timestamps[slot] = timestamp
+        self._quality[slot] = quality
+
+    def get_with_age(self, dp_id: int, now: float | None = None) -> tuple:
+        """returns (value, seconds since last update), (None, None) if unknown"""
+        if dp_id not in self:
+            return None, None
+        if now is None:
+            now = time.monotonic()
+        slot = self._slot(dp_id)
+        return self._values[slot], now - self._timestamps[slot]
+
+    def get_timestamp(self, dp_id: int) -> float | None:
+        """returns monotonic time of the last update, None if unknown"""
+        if dp_id not in self:
+            return None
+        return self._timestamps[self._slot(dp_id)]
+
+    def get_quality(self, dp_id: int) -> int:
+        slot = self._slot(dp_id)
+        if slot >= 0:
+            return self._quality[slot]
+        return QUALITY_UNKNOWN
+
+    def set_quality(self, quality: int, dp_id=None) -> None:
+        """sets quality of one datapoint or, if dp_id is None, of all values"""
+        if dp_id is not None:
+            self._quality[self._index(dp_id)] = quality
+            return
+        for index, value in enumerate(self._values):
+            if value is not _MISSING:
+                self._quality[index] = quality
+
+    def snapshot(self, dp_ids=None) -> list:
+        """returns DatapointStates of all (or the given) datapoints with a value"""
+        if dp_ids is None:
+            dp_ids = self
+        states = []
+        for dp_id in dp_ids:
+            if dp_id in self:
+                slot = self._slot(dp_id)
+                states.append(
+                    DatapointState(
+                        dp_id,
+                        self._values[slot],
+                        self._timestamps[slot],
+                        self._quality[slot],
+                    )
+                )
+        return states
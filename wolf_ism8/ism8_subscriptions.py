@@ -0,0 +1,93 @@
+"""
+Index of callbacks subscribed to datapoints, devices, datatypes or everything
+"""
+
+from .ism8_constants import *
+
+
+class SubscriptionIndex:
+    """
+    Keeps the subscribers of datapoint updates. A subscription is either for
+    a single datapoint, for all datapoints of a device (IX_DEVICENAME), for all
+    datapoints of a datatype or for all datapoints. For dispatching, the
+    listeners of a datapoint are merged into a fan-out tuple, which is cached
+    until subscriptions change.
+    """
+
+    def __init__(self):
+        self._by_dp = {}
+        self._by_device = {}
+        self._by_type = {}
+        self._all = []
+        # datapoints which can be subscribed to, None for all datapoints
+        self._active = None
+        # dp_id -> tuple of (callback, pass_update)
+        self._fanout = {}
+        return
+
+    def subscribe(
+        self, cb, dp_id=None, device=None, dp_type=None, pass_update=True
+    ) -> bool:
+        """
+        adds a subscriber. If pass_update is set, cb is called with the
+        DatapointUpdate, otherwise without arguments. Without dp_id, device
+        or dp_type, cb subscribes to all datapoints. Returns False if dp_id
+        is not active
+        """
+        if dp_id is not None and self._active is not None:
+            if dp_id not in self._active:
+                return False
+        self._entries(dp_id, device, dp_type, create=True).append((cb, pass_update))
+        self._fanout.clear()
+        return True
+
+    def unsubscribe(self, cb=None, dp_id=None, device=None, dp_type=None) -> None:
+        """removes a subscriber, or all subscribers of the key if cb is None"""
+        entries = self._entries(dp_id, device, dp_type, create=False)
+        if entries:
+            entries[:] = [
+                entry for entry in entries if cb is not None and entry[0] != cb
+            ]
+        self._fanout.clear()
+
+    def set_active(self, dp_ids=None) -> None:
+        """
+        restricts subscriptions of single datapoints to dp_ids. Subscriptions
+        of other datapoints are kept, but get no updates until their datapoint
+        is active again. None allows all datapoints
+        """
+        self._active = None if dp_ids is None else frozenset(dp_ids)
+        self._fanout.clear()
+
+    def get_listeners(self, dp_id: int) -> tuple:
+        """returns all (callback, pass_update) tuples for a datapoint"""
+        fanout = self._fanout.get(dp_id)
+        if fanout is None:
+            dp = DATAPOINTS.get(dp_id, (None, None, None, None))
+            by_dp = self._by_dp.get(dp_id, [])
+            if self._active is not None and dp_id not in self._active:
+                by_dp = []
+            fanout = tuple(
+                by_dp
+                + self._by_device.get(dp[IX_DEVICENAME], [])
+                + self._by_type.get(dp[IX_TYPE], [])
+                + self._all
+            )
+            self._fanout[dp_id] = fanout
+        return fanout
+
+    def has_listeners(self, dp_id: int) -> bool:
+        return len(self.get_listeners(dp_id)) > 0
+
+    def _entries(self, dp_id, device, dp_type, create: bool) -> list | None:
+        if dp_id is not None:
+            index, key = self._by_dp, dp_id
+        elif device is not None:
+            index, key = self._by_device, device
+        elif dp_type is not None:
+            index, key = self._by_type, dp_type
+        else:
+            return self._all
+        if create:
+            return index.setdefault(key, [])
+        return index.get(key)
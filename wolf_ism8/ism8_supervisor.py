@@ -0,0 +1,126 @@
+"""
+Supervision of the ISM8 link: stale values after silence, resync on reconnect
+"""
+
+import logging
+import asyncio
+import time
+from .ism8_constants import *
+from .ism8_store import *
+
+log = logging.getLogger(__name__)
+
+
+def plan_ranges(dp_ids, max_gap: int = ISM_REFRESH_MAX_GAP) -> list:
+    """
+    merges datapoint ids into (start, count) ranges for 'get datapoint value'
+    requests. Ids with at most max_gap other ids between them share a range,
+    as one request is cheaper than two
+    """
+    ranges = []
+    for dp_id in sorted(dp_ids):
+        if ranges and dp_id - sum(ranges[-1]) <= max_gap:
+            start = ranges[-1][0]
+            ranges[-1] = (start, dp_id - start + 1)
+        else:
+            ranges.append((dp_id, 1))
+    return ranges
+
+
+class ConnectionSupervisor:
+    """
+    Watches the time since the last frame from ISM8. After silence_timeout
+    seconds, all values are marked stale and a resync is requested, which a
+    living ISM8 answers. After a reconnect, all values are marked unknown
+    until they are refreshed by a resync. Resyncs are requested at most once
+    per resync_interval seconds.
+    """
+
+    def __init__(
+        self,
+        resync,
+        set_quality,
+        silence_timeout: float = ISM_SILENCE_TIMEOUT,
+        resync_interval: float = ISM_RESYNC_INTERVAL,
+    ):
+        self._resync = resync
+        self._set_quality = set_quality
+        self.silence_timeout = silence_timeout
+        self.resync_interval = resync_interval
+        # monotonic time of the last frame from ISM8
+        self.last_frame = time.monotonic()
+        self._last_resync = None
+        self._resync_pending = False
+        self._connected = False
+        self._stale = False
+        self._task = None
+        self.resyncs = 0
+        self.stale_events = 0
+        return
+
+    def is_stale(self) -> bool:
+        """returns True if ISM8 has been silent for longer than silence_timeout"""
+        return self._stale
+
+    def connection_made(self) -> None:
+        """marks all values unknown and requests all datapoints"""
+        now = time.monotonic()
+        self._connected = True
+        self._stale = False
+        self.last_frame = now
+        self._set_quality(QUALITY_UNKNOWN)
+        self._resync_pending = True
+        self._try_resync(now)
+        self.start()
+
+    def connection_lost(self) -> None:
+        self._connected = False
+        self._set_quality(QUALITY_STALE)
+        self.stop()
+
+    def frame_received(self, now: float) -> None:
+        self.last_frame = now
+        self._stale = False
+
+    def check(self, now: float | None = None) -> None:
+        """one supervision step, called periodically by the supervisor task"""
+        if not self._connected:
+            return
+        if now is None:
+            now = time.monotonic()
+        if self._resync_pending:
+            self._try_resync(now)
+        if not self._stale and now - self.last_frame > self.silence_timeout:
+            log.warning(f"no data from ISM8 for {now - self.last_frame:.0f}s")
+            self._stale = True
+            self.stale_events += 1
+            self._set_quality(QUALITY_STALE)
+            self._resync_pending = True
+            self._try_resync(now)
+
+    def _try_resync(self, now: float) -> bool:
+        if self._last_resync is not None:
+            if now - self._last_resync < self.resync_interval:
+                return False
+        self._last_resync = now
+        self._resync_pending = False
+        self.resyncs += 1
+        log.debug("supervisor requests resync")
+        self._resync()
+        return True
+
+    def start(self) -> None:
+        """starts the supervisor task, needs a running event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        interval = min(self.silence_timeout, self.resync_interval) / 4
+        while True:
+            await asyncio.sleep(interval)
+            self.check()
@@ -0,0 +1,114 @@
+"""
+Queue for outgoing writes, coalesced per datapoint and paced for ISM8
+"""
+
+import logging
+import asyncio
+import time
+from collections import OrderedDict
+from .ism8_constants import *
+
+log = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    """
+    Outgoing writes, waiting window seconds after the first write of a
+    datapoint. Further writes of the same datapoint within the window replace
+    the queued value, so only the last one is sent. Due writes are packed into
+    frames, which are sent at most once per min_interval seconds.
+    """
+
+    def __init__(
+        self,
+        pack,
+        write,
+        window: float = ISM_WRITE_WINDOW,
+        min_interval: float = ISM_WRITE_MIN_INTERVAL,
+        maxsize: int = ISM_MAX_QUEUED_WRITES,
+    ):
+        # pack: list of (dp_id, encoded_value) -> list of frames
+        self._pack = pack
+        self._write = write
+        self._window = window
+        self._min_interval = min_interval
+        self._maxsize = maxsize
+        # dp_id -> (encoded value, monotonic time when it is due)
+        self._queue = OrderedDict()
+        self._last_frame = None
+        self._task = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.coalesced = 0
+        self.dropped = 0
+        self.frames_sent = 0
+        return
+
+    def qsize(self) -> int:
+        return len(self._queue)
+
+    def put(self, dp_id: int, encoded_value) -> bool:
+        """queues a write, returns False if the queue is full"""
+        entry = self._queue.get(dp_id)
+        if entry is not None:
+            self._queue[dp_id] = (encoded_value, entry[1])
+            self.coalesced += 1
+            return True
+        if len(self._queue) >= self._maxsize:
+            log.error(f"write queue full, dropping write of datapoint {dp_id}")
+            self.dropped += 1
+            return False
+        self._queue[dp_id] = (encoded_value, time.monotonic() + self._window)
+        self._idle.clear()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._worker())
+        return True
+
+    def discard(self, dp_id: int) -> None:
+        """removes a queued write, e.g. when it is superseded by a direct write"""
+        self._queue.pop(dp_id, None)
+
+    def clear(self) -> None:
+        """drops all queued writes"""
+        self.dropped += len(self._queue)
+        self._queue.clear()
+
+    def stop(self) -> None:
+        """stops the worker, queued writes are dropped"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.clear()
+        self._idle.set()
+
+    async def join(self) -> None:
+        """waits until all queued writes have been sent"""
+        await self._idle.wait()
+
+    async def _worker(self) -> None:
+        try:
+            while self._queue:
+                # the first entry is due first, coalescing keeps its position
+                _, due_time = next(iter(self._queue.values()))
+                delay = due_time - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                now = time.monotonic()
+                due = []
+                while self._queue:
+                    dp_id, (encoded_value, due_time) = next(iter(self._queue.items()))
+                    if due_time > now:
+                        break
+                    del self._queue[dp_id]
+                    due.append((dp_id, encoded_value))
+                for frame in self._pack(due):
+                    if self._last_frame is not None:
+                        delay = self._last_frame + self._min_interval - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    self._write(frame)
+                    self._last_frame = time.monotonic()
+                    self.frames_sent += 1
+        finally:
+            self._task = None
+            self._idle.set()